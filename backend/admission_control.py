@@ -0,0 +1,177 @@
+import asyncio
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Deque, Dict
+
+from fastapi import Depends, HTTPException
+
+from metrics import metrics
+
+
+class Priority(IntEnum):
+    LOW = 0
+    NORMAL = 1
+    HIGH = 2
+
+
+# Share of the wait queue each priority may fill before it gets shed, so
+# low priority traffic is turned away well before paid generations
+QUEUE_SHARE_BY_PRIORITY = {
+    Priority.LOW: 0.25,
+    Priority.NORMAL: 0.75,
+    Priority.HIGH: 1.0,
+}
+
+# Weight of the newest sample in the queue wait moving average
+QUEUE_WAIT_EWMA_ALPHA = 0.2
+
+
+class AdmissionController:
+    """Bounds concurrent work and sheds or degrades requests under overload.
+
+    Requests beyond `max_concurrency` wait in a queue and freed slots go to
+    the highest priority waiting, oldest first. Each priority may only use
+    part of that queue, and waits are capped, so overload turns into fast
+    503s instead of timeouts. When the average queue wait stays above
+    `degrade_queue_wait_seconds` the controller switches into degraded mode,
+    where callers are expected to skip the LLM. It switches back once the
+    wait stays low for `recover_after_seconds`.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrency: int = 64,
+        max_queue_depth: int = 128,
+        max_queue_wait_seconds: float = 10,
+        degrade_queue_wait_seconds: float = 2,
+        recover_after_seconds: float = 30,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue_depth = max_queue_depth
+        self.max_queue_wait_seconds = max_queue_wait_seconds
+        self.degrade_queue_wait_seconds = degrade_queue_wait_seconds
+        self.recover_after_seconds = recover_after_seconds
+        self.degraded = False
+        self._active = 0
+        self._waiters: Dict[Priority, Deque[asyncio.Future]] = {
+            priority: deque() for priority in Priority
+        }
+        self._queued = 0
+        self._in_flight_by_route: Dict[str, int] = defaultdict(int)
+        self._queue_wait_ewma = 0.0
+        self._healthy_since: float | None = None
+
+    @asynccontextmanager
+    async def admit(self, route: str, priority: Priority):
+        queue_limit = self.max_queue_depth * QUEUE_SHARE_BY_PRIORITY[priority]
+        if self._active >= self.max_concurrency and self._queued >= queue_limit:
+            self._reject(route, priority, "queue_full")
+
+        queued_at = time.monotonic()
+        self._queued += 1
+        metrics.set_gauge("admission.queued", self._queued)
+        try:
+            await asyncio.wait_for(
+                self._acquire(priority), timeout=self.max_queue_wait_seconds
+            )
+        except TimeoutError:
+            self._reject(route, priority, "queue_timeout")
+        finally:
+            self._queued -= 1
+            metrics.set_gauge("admission.queued", self._queued)
+
+        queue_wait = time.monotonic() - queued_at
+        metrics.observe(f"admission.queue_wait.{route}", queue_wait)
+        self._queue_wait_ewma += QUEUE_WAIT_EWMA_ALPHA * (
+            queue_wait - self._queue_wait_ewma
+        )
+        self._update_mode()
+
+        self._in_flight_by_route[route] += 1
+        metrics.set_gauge(
+            f"admission.in_flight.{route}", self._in_flight_by_route[route]
+        )
+        try:
+            yield
+        finally:
+            self._in_flight_by_route[route] -= 1
+            metrics.set_gauge(
+                f"admission.in_flight.{route}", self._in_flight_by_route[route]
+            )
+            self._release()
+            if self._queued == 0:
+                # Nobody is waiting, so let the average decay between samples
+                self._queue_wait_ewma *= 1 - QUEUE_WAIT_EWMA_ALPHA
+            self._update_mode()
+
+    def dependency(self, route: str, priority: Priority):
+        """Admission control as a FastAPI dependency for fixed-priority routes."""
+
+        async def admit_request():
+            async with self.admit(route, priority):
+                yield
+
+        return Depends(admit_request)
+
+    async def _acquire(self, priority: Priority):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[priority].append(waiter)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The slot may have been granted just before the wait timed out
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        for priority in sorted(Priority, reverse=True):
+            waiters = self._waiters[priority]
+            while waiters and self._active < self.max_concurrency:
+                waiter = waiters.popleft()
+                # Waiters that timed out are left in the queue
+                if not waiter.done():
+                    waiter.set_result(None)
+                    self._active += 1
+
+    def _reject(self, route: str, priority: Priority, reason: str):
+        metrics.increment(f"admission.rejected.{priority.name.lower()}.{reason}")
+        metrics.increment(f"admission.rejected_by_route.{route}")
+        raise HTTPException(
+            status_code=503,
+            detail="We're getting a lot of traffic right now. Please try again in a bit.",
+            headers={"Retry-After": "5"},
+        )
+
+    def _update_mode(self):
+        now = time.monotonic()
+        overloaded = self._queue_wait_ewma > self.degrade_queue_wait_seconds
+        if overloaded:
+            self._healthy_since = None
+            if not self.degraded:
+                self._set_degraded(True)
+        elif self.degraded:
+            if self._healthy_since is None:
+                self._healthy_since = now
+            elif now - self._healthy_since >= self.recover_after_seconds:
+                self._set_degraded(False)
+
+    def _set_degraded(self, degraded: bool):
+        self.degraded = degraded
+        metrics.set_gauge("admission.degraded", int(degraded))
+        metrics.increment(
+            "admission.transitions.to_degraded"
+            if degraded
+            else "admission.transitions.to_normal"
+        )
+        print(
+            f"Admission control switched to {'degraded' if degraded else 'normal'} mode"
+        )
@@ -0,0 +1,73 @@
+"""Throughput of YC page parsing at different CPU pool sizes.
+
+Run from the backend directory:
+
+    python -m benchmarks.parse_throughput
+
+Pool size 0 is the single process baseline where parsing runs on the event
+loop. This only varies the pool size inside one process, see
+benchmarks.serving_throughput for throughput with 1, 2, 4 and 8 gunicorn
+workers.
+"""
+
+import asyncio
+import html
+import json
+import time
+
+from cpu_pool import configure_cpu_pool, run_on_html
+from website_scraper import parse_yc_company_html
+
+POOL_SIZES = [0, 1, 2, 4, 8]
+CONCURRENT_PAGES = 64
+
+
+def make_yc_company_page() -> bytes:
+    data_page = {
+        "props": {
+            "company": {
+                "name": "Lark",
+                "small_logo_url": "https://example.com/small_logos/lark.png",
+                "long_description": "Billing for AI companies. " * 200,
+            }
+        }
+    }
+    founders = "".join(
+        f"<div class='founder'><h3>Founder {i}</h3><p>{'Builder of things. ' * 40}</p></div>"
+        for i in range(200)
+    )
+    return (
+        "<html><body>"
+        f'<div id="ycdc_new/pages/Companies/ShowPage-react-component" '
+        f'data-page="{html.escape(json.dumps(data_page))}"></div>'
+        f"<h1>Lark</h1>{founders}"
+        "</body></html>"
+    ).encode()
+
+
+async def measure(pool_size: int, page: bytes) -> float:
+    configure_cpu_pool(pool_size)
+    # Warm up the pool so process start up isn't measured
+    await run_on_html(parse_yc_company_html, page, "utf-8")
+
+    start = time.monotonic()
+    await asyncio.gather(
+        *[
+            run_on_html(parse_yc_company_html, page, "utf-8")
+            for _ in range(CONCURRENT_PAGES)
+        ]
+    )
+    return CONCURRENT_PAGES / (time.monotonic() - start)
+
+
+async def run():
+    page = make_yc_company_page()
+    print(f"Page size: {len(page) / 1024:.0f} KB")
+    for pool_size in POOL_SIZES:
+        pages_per_second = await measure(pool_size, page)
+        print(f"pool size {pool_size}: {pages_per_second:.1f} pages/s")
+    configure_cpu_pool(0)
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
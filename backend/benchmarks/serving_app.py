@@ -0,0 +1,29 @@
+"""Scrape-only app that benchmarks.serving_throughput runs under gunicorn.
+
+The generation endpoint needs Stytch, OpenAI and Redis, so the harness
+serves the part of it that scales with workers instead: the real
+WebsiteScraper, including the CPU pool, against a local page server.
+"""
+
+from typing import Literal
+
+from fastapi import FastAPI
+
+from website_scraper import WebsiteScraper
+
+app = FastAPI()
+website_scraper = WebsiteScraper()
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/scrape")
+async def scrape(url: str, mode: Literal["yc_company", "any_url"]):
+    if mode == "yc_company":
+        company_info = await website_scraper.extract_yc_data_using_http(url)
+        return {"company_name": company_info.company_name if company_info else None}
+    general_url_data = await website_scraper.extract_general_url_data_using_http(url)
+    return {"text_length": len(general_url_data.raw_text)}
@@ -0,0 +1,206 @@
+"""End-to-end scrape throughput with 1, 2, 4 and 8 gunicorn workers.
+
+Run from the backend directory:
+
+    python -m benchmarks.serving_throughput
+
+Each run starts `gunicorn benchmarks.serving_app:app -c gunicorn.conf.py`
+with WEB_CONCURRENCY set to the worker count, so workers are configured
+exactly like production. CPU_POOL_WORKERS is passed through, set it to
+compare pool sizes. Pages come from a local `http.server` process, which
+can itself become the bottleneck at high worker counts on small machines.
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.parse_throughput import make_yc_company_page
+from metrics import percentile
+
+WORKER_COUNTS = [1, 2, 4, 8]
+CONCURRENT_REQUESTS = 64
+REQUESTS_PER_RUN = 1000
+STARTUP_TIMEOUT_SECONDS = 60
+
+
+def make_general_url_page() -> bytes:
+    paragraphs = "".join(
+        f"<p>Paragraph {i}. {'We make billing simple for AI companies. ' * 20}</p>"
+        for i in range(500)
+    )
+    return f"<html><body><h1>Lark</h1>{paragraphs}</body></html>".encode()
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_page_server(directory: str) -> tuple[subprocess.Popen, int]:
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "http.server",
+            str(port),
+            "--bind",
+            "127.0.0.1",
+            "--directory",
+            directory,
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return process, port
+
+
+def start_gunicorn(workers: int) -> tuple[subprocess.Popen, int]:
+    port = free_port()
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(workers),
+        "PORT": str(port),
+        # WebsiteScraper builds a Redis client for robots.txt, which is never
+        # used here since robots.txt isn't respected
+        "UPSTASH_REDIS_REST_URL": os.getenv("UPSTASH_REDIS_REST_URL")
+        or "http://127.0.0.1:1",
+        "UPSTASH_REDIS_REST_TOKEN": os.getenv("UPSTASH_REDIS_REST_TOKEN") or "unused",
+        "FETCH_RESPECT_ROBOTS_TXT": "false",
+    }
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "benchmarks.serving_app:app",
+            "-c",
+            "gunicorn.conf.py",
+            "--access-logfile",
+            "/dev/null",
+            "--log-level",
+            "warning",
+        ],
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+    return process, port
+
+
+async def wait_until_ready(client: httpx.AsyncClient, base_url: str):
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get(f"{base_url}/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"gunicorn didn't start within {STARTUP_TIMEOUT_SECONDS}s")
+
+
+async def measure(base_url: str, page_url: str, mode: str, requests: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async with httpx.AsyncClient(
+        timeout=60,
+        limits=httpx.Limits(max_connections=CONCURRENT_REQUESTS),
+    ) as client:
+        await wait_until_ready(client, base_url)
+        # Warm up every worker's pool so process start up isn't measured
+        await asyncio.gather(
+            *[
+                client.get(f"{base_url}/scrape", params={"url": page_url, "mode": mode})
+                for _ in range(CONCURRENT_REQUESTS)
+            ],
+            return_exceptions=True,
+        )
+
+        async def run_requests():
+            nonlocal errors
+            for _ in remaining:
+                started_at = time.monotonic()
+                try:
+                    response = await client.get(
+                        f"{base_url}/scrape", params={"url": page_url, "mode": mode}
+                    )
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.monotonic() - started_at)
+
+        start = time.monotonic()
+        await asyncio.gather(*[run_requests() for _ in range(CONCURRENT_REQUESTS)])
+        elapsed = time.monotonic() - start
+
+    latencies.sort()
+    return {
+        "requests_per_second": requests / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "errors": errors,
+    }
+
+
+def run(mode: str, worker_counts: list[int], requests: int):
+    with tempfile.TemporaryDirectory() as directory:
+        for name, page in [
+            ("yc_company.html", make_yc_company_page()),
+            ("any_url.html", make_general_url_page()),
+        ]:
+            with open(os.path.join(directory, name), "wb") as f:
+                f.write(page)
+
+        page_server, page_port = start_page_server(directory)
+        page_url = f"http://127.0.0.1:{page_port}/{mode}.html"
+        print(
+            f"mode {mode}, CPU_POOL_WORKERS={os.getenv('CPU_POOL_WORKERS') or 0}, "
+            f"{CONCURRENT_REQUESTS} concurrent requests"
+        )
+        try:
+            for workers in worker_counts:
+                gunicorn, port = start_gunicorn(workers)
+                try:
+                    result = asyncio.run(
+                        measure(f"http://127.0.0.1:{port}", page_url, mode, requests)
+                    )
+                finally:
+                    gunicorn.terminate()
+                    gunicorn.wait()
+                if result["p50"] is None:
+                    print(f"{workers} workers: every request failed")
+                    continue
+                print(
+                    f"{workers} workers: {result['requests_per_second']:.1f} req/s, "
+                    f"p50 {result['p50'] * 1000:.0f} ms, "
+                    f"p99 {result['p99'] * 1000:.0f} ms, "
+                    f"{result['errors']} errors"
+                )
+        finally:
+            page_server.terminate()
+            page_server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--mode", choices=["yc_company", "any_url"], default="yc_company"
+    )
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=WORKER_COUNTS, metavar="N"
+    )
+    parser.add_argument("--requests", type=int, default=REQUESTS_PER_RUN)
+    args = parser.parse_args()
+    run(args.mode, args.workers, args.requests)
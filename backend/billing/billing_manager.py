@@ -24,6 +24,13 @@ class UpdateSubscriptionResponse(BaseModel):
     checkout_url: str | None
 
 
+class BillingState(BaseModel):
+    subscription_id: str
+    rate_card_id: str
+    included_units: int
+    used_units: int
+
+
 class BillingManager:
     def __init__(self):
         assert LARK_API_KEY is not None
@@ -108,6 +115,21 @@ class BillingManager:
         else:
             raise ValueError(f"Unexpected response type: {response.result.type}")
 
+    def retrieve_billing_state(self, subject_external_id: str) -> BillingState:
+        billing_state = self.lark.customer_access.retrieve_billing_state(
+            subject_id=subject_external_id
+        )
+        # We always subscribe users to the free plan on signup and track a
+        # single pricing metric, so there is exactly one of each
+        subscription = billing_state.active_subscriptions[0]
+        usage_data = billing_state.usage_data[0]
+        return BillingState(
+            subscription_id=subscription.subscription_id,
+            rate_card_id=subscription.rate_card_id,
+            included_units=usage_data.included_units,
+            used_units=int(usage_data.used_units),
+        )
+
     def create_customer_portal_session(self, subject_external_id: str, return_url: str):
         customer_portal_session = self.lark.customer_portal.create_session(
             subject_id=subject_external_id,
@@ -1,150 +1,330 @@
-import uuid
-from lark import (
-    Amount,
-    CreateFixedRateRequest,
-    CreateRateCardRequestUsageBasedRatesItem_Simple,
-    Lark,
-    Price_Flat,
-    PricingMetricAggregation_Sum,
-)
+import argparse
+import asyncio
+import json
 import os
+from typing import Any, Dict, List, Tuple
+
 from dotenv import load_dotenv
+from lark import AsyncLark
+from lark.types import FlatPriceInputParam
 
 load_dotenv()
 
 LARK_API_KEY = os.getenv("LARK_API_KEY")
-assert LARK_API_KEY is not None
-
 LARK_BASE_URL = os.getenv("LARK_BASE_URL")
 
-lark = Lark(
-    api_key=LARK_API_KEY,
-    base_url=LARK_BASE_URL if LARK_BASE_URL else None,
-)
+DEFAULT_PLAN_SPEC_PATH = os.path.join(os.path.dirname(__file__), "pricing_plans.json")
+
+# Everything about a rate card that we provision, in a comparable form
+RateCardSignature = Tuple[str, str, str, tuple, tuple]
+
+LIST_PAGE_SIZE = 100
+
+
+class PricingMetricMismatch(Exception):
+    pass
 
 
 # Note: All of this can also be done in the Lark Dashboard
-class LarkPricingPlanGenerator:
-    def __init__(self):
-        pass
+class LarkPricingPlanProvisioner:
+    """Makes the pricing metric and rate cards in Lark match a plan spec.
 
-    def create_pricing_metric(self):
-        # This helps us track usage and bill for it
-        pricing_metric = lark.pricing_metrics.create_pricing_metric(
-            name="Character Generation",
-            event_name=f"character_generation_{uuid.uuid4().hex}",
-            aggregation=PricingMetricAggregation_Sum(value_field="value"),
-            unit="character generations",
+    Existing objects are matched by event name (pricing metric) and by their
+    full contents (rate cards), so re-running against an already provisioned
+    environment creates nothing. Pricing metrics can't be updated, so one
+    whose event name matches but whose definition doesn't is an error. Rate cards can't be edited once customers
+    are subscribed to them, so a changed plan gets a new rate card and the
+    old one is left for existing subscriptions.
+    """
+
+    def __init__(self, lark: AsyncLark, plan_spec: Dict[str, Any]):
+        self.lark = lark
+        self.plan_spec = plan_spec
+
+    async def provision(self, dry_run: bool = False) -> Dict[str, str]:
+        """Provision the plan spec and return env var name -> value."""
+        existing_pricing_metrics, existing_rate_cards = await asyncio.gather(
+            self._list_pricing_metrics(),
+            self._list_rate_cards(),
         )
-        print(f"Pricing metric created: {pricing_metric}")
-        return pricing_metric
-
-    def create_free_plan_rate_card(self, pricing_metric_id: str):
-        rate_card = lark.rate_cards.create_rate_card(
-            name="Free plan",
-            description="Free plan that every new user gets subscribed to",
-            billing_interval="monthly",
-            usage_based_rates=[
-                self._create_character_generation_usage_rate(
-                    pricing_metric_id=pricing_metric_id,
-                    # free users get 5 character generations per month
-                    included_units=5,
-                    # Since we don't allow users to go over included
-                    # quantity on this plan, we just create a zero dollar
-                    # price here since this won't really be used
-                    per_unit_amount_in_cents=0,
-                ),
-            ],
+
+        pricing_metric_spec = self.plan_spec["pricing_metric"]
+        pricing_metric_id = await self._ensure_pricing_metric(
+            pricing_metric_spec, existing_pricing_metrics, dry_run
         )
-        print(f"Free plan rate card created: {rate_card}")
 
-    def create_starter_plan_rate_card(self, pricing_metric_id: str):
-        rate_card = lark.rate_cards.create_rate_card(
-            name="Starter plan",
-            description="Starter plan that provides 20 additional character generations per month",
-            billing_interval="monthly",
-            fixed_rates=[
-                CreateFixedRateRequest(
-                    name="Starter base rate",
-                    price=Price_Flat(
-                        amount=Amount(
-                            value="2000",  # $20
-                            currency_code="USD",
-                        )
-                    ),
+        # Rate cards only depend on the pricing metric, so create them together
+        rate_card_specs = self.plan_spec["rate_cards"]
+        rate_card_ids = await asyncio.gather(
+            *[
+                self._ensure_rate_card(
+                    rate_card_spec, pricing_metric_id, existing_rate_cards, dry_run
                 )
-            ],
-            usage_based_rates=[
-                self._create_character_generation_usage_rate(
-                    pricing_metric_id=pricing_metric_id,
-                    # 5 carry over from free plan + 20 more
-                    included_units=25,
-                    # still zero dollars since we won't let users
-                    # go over included quantity on this plan
-                    per_unit_amount_in_cents=0,
-                ),
-            ],
+                for rate_card_spec in rate_card_specs
+            ]
         )
-        print(f"Starter plan rate card created: {rate_card}")
 
-    def create_premium_plan_rate_card(self, pricing_metric_id: str):
-        rate_card = lark.rate_cards.create_rate_card(
-            name="Premium plan",
-            description="Premium plan that provides 100 additional character generations per month. Character generations after the included quantity are billed at 90 cents per generation.",
-            billing_interval="monthly",
-            fixed_rates=[
-                CreateFixedRateRequest(
-                    name="Premium base rate",
-                    price=Price_Flat(
-                        amount=Amount(
-                            value="10000",  # $100
-                            currency_code="USD",
-                        )
-                    ),
+        env = {pricing_metric_spec["env_var"]: pricing_metric_spec["event_name"]}
+        for rate_card_spec, rate_card_id in zip(rate_card_specs, rate_card_ids):
+            env[rate_card_spec["env_var"]] = rate_card_id
+        return env
+
+    async def _ensure_pricing_metric(
+        self,
+        pricing_metric_spec: Dict[str, Any],
+        existing_pricing_metrics: List[Any],
+        dry_run: bool,
+    ) -> str:
+        wanted = _pricing_metric_definition_from_spec(pricing_metric_spec)
+        for pricing_metric in existing_pricing_metrics:
+            if pricing_metric.event_name != pricing_metric_spec["event_name"]:
+                continue
+            # Usage is reported by event name, so a second metric for the same
+            # event would bill it twice
+            existing = _pricing_metric_definition_from_lark(pricing_metric)
+            if existing != wanted:
+                differences = "\n".join(
+                    f"  {field}: {existing[field]!r} in Lark, {wanted[field]!r} in spec"
+                    for field in wanted
+                    if existing[field] != wanted[field]
                 )
+                raise PricingMetricMismatch(
+                    f"Pricing metric {pricing_metric.id} for event "
+                    f"{pricing_metric.event_name!r} doesn't match the spec:\n"
+                    f"{differences}\n"
+                    "Fix it in the Lark dashboard or use a new event name."
+                )
+            print(f"Pricing metric up to date: {pricing_metric.id}")
+            return pricing_metric.id
+
+        if dry_run:
+            print(f"Would create pricing metric: {pricing_metric_spec['name']}")
+            return "<new pricing metric>"
+
+        # This helps us track usage and bill for it
+        pricing_metric = await self.lark.pricing_metrics.create(
+            name=pricing_metric_spec["name"],
+            event_name=pricing_metric_spec["event_name"],
+            aggregation={
+                "aggregation_type": "sum",
+                "value_field": pricing_metric_spec["aggregation_value_field"],
+            },
+            unit=pricing_metric_spec["unit"],
+        )
+        print(f"Pricing metric created: {pricing_metric.id}")
+        return pricing_metric.id
+
+    async def _ensure_rate_card(
+        self,
+        rate_card_spec: Dict[str, Any],
+        pricing_metric_id: str,
+        existing_rate_cards: List[Any],
+        dry_run: bool,
+    ) -> str:
+        wanted = _rate_card_signature_from_spec(rate_card_spec, pricing_metric_id)
+        for rate_card in existing_rate_cards:
+            if _rate_card_signature_from_lark(rate_card) == wanted:
+                print(f"{rate_card_spec['name']} up to date: {rate_card.id}")
+                return rate_card.id
+
+        if dry_run:
+            print(f"Would create rate card: {rate_card_spec['name']}")
+            return f"<new {rate_card_spec['name']}>"
+
+        rate_card = await self.lark.rate_cards.create(
+            name=rate_card_spec["name"],
+            description=rate_card_spec["description"],
+            billing_interval=rate_card_spec["billing_interval"],
+            fixed_rates=[
+                {
+                    "code": fixed_rate["code"],
+                    "name": fixed_rate["name"],
+                    "price": _flat_price(fixed_rate["amount_in_cents"]),
+                }
+                for fixed_rate in rate_card_spec["fixed_rates"]
             ],
             usage_based_rates=[
-                self._create_character_generation_usage_rate(
-                    pricing_metric_id=pricing_metric_id,
-                    # 5 carry over from free plan + 100 more
-                    included_units=105,
-                    #  unlimited character generations are allowed in this plan.
-                    # If users go over included quantity, they are billed at 80 cents per generation.
-                    per_unit_amount_in_cents=90,
-                ),
+                {
+                    "usage_based_rate_type": "simple",
+                    "code": usage_rate["code"],
+                    "name": usage_rate["name"],
+                    "included_units": usage_rate["included_units"],
+                    "pricing_metric_id": pricing_metric_id,
+                    "price": _flat_price(usage_rate["per_unit_amount_in_cents"]),
+                }
+                for usage_rate in rate_card_spec["usage_based_rates"]
             ],
         )
-        print(f"Premium plan rate card created: {rate_card}")
+        print(f"{rate_card_spec['name']} rate card created: {rate_card.id}")
+        return rate_card.id
 
-    def _create_character_generation_usage_rate(
-        self,
-        *,
-        pricing_metric_id: str,
-        included_units: int,
-        per_unit_amount_in_cents: int,
-    ):
-        return CreateRateCardRequestUsageBasedRatesItem_Simple(
-            name="Character generation usage rate",
-            included_units=included_units,
-            pricing_metric_id=pricing_metric_id,
-            price=Price_Flat(
-                amount=Amount(
-                    value=str(per_unit_amount_in_cents),
-                    currency_code="USD",
+    async def _list_pricing_metrics(self) -> List[Any]:
+        # Anything we miss here gets created again, so read every page
+        pricing_metrics = {}
+        has_more = True
+        while has_more:
+            response = await self.lark.pricing_metrics.list(
+                limit=LIST_PAGE_SIZE,
+                # The SDK only exposes limit for pricing metrics
+                extra_query={"offset": len(pricing_metrics)},
+            )
+            new_pricing_metrics = [
+                pricing_metric
+                for pricing_metric in response.pricing_metrics
+                if pricing_metric.id not in pricing_metrics
+            ]
+            if response.has_more and not new_pricing_metrics:
+                # The offset isn't part of the SDK, if the API stops honoring
+                # it we'd see the same page forever
+                raise RuntimeError(
+                    "Listing pricing metrics returned no new pricing metrics "
+                    f"after {len(pricing_metrics)}, is offset still supported?"
                 )
-            ),
-        )
+            for pricing_metric in new_pricing_metrics:
+                pricing_metrics[pricing_metric.id] = pricing_metric
+            has_more = response.has_more
+        return list(pricing_metrics.values())
 
+    async def _list_rate_cards(self) -> List[Any]:
+        rate_cards = []
+        has_more = True
+        while has_more:
+            response = await self.lark.rate_cards.list(
+                limit=LIST_PAGE_SIZE, offset=len(rate_cards)
+            )
+            rate_cards.extend(response.rate_cards)
+            has_more = response.has_more and bool(response.rate_cards)
+        return rate_cards
 
-if __name__ == "__main__":
-    lark_pricing_plan_generator = LarkPricingPlanGenerator()
-    pricing_metric = lark_pricing_plan_generator.create_pricing_metric()
-    lark_pricing_plan_generator.create_free_plan_rate_card(
-        pricing_metric_id=pricing_metric.id
+
+def _pricing_metric_definition_from_spec(
+    pricing_metric_spec: Dict[str, Any],
+) -> Dict[str, Any]:
+    return {
+        "name": pricing_metric_spec["name"],
+        "unit": pricing_metric_spec["unit"],
+        "aggregation_type": "sum",
+        "aggregation_value_field": pricing_metric_spec["aggregation_value_field"],
+    }
+
+
+def _pricing_metric_definition_from_lark(pricing_metric: Any) -> Dict[str, Any]:
+    return {
+        "name": pricing_metric.name,
+        "unit": pricing_metric.unit,
+        "aggregation_type": pricing_metric.aggregation.aggregation_type,
+        "aggregation_value_field": getattr(
+            pricing_metric.aggregation, "value_field", None
+        ),
+    }
+
+
+def _flat_price(amount_in_cents: int) -> FlatPriceInputParam:
+    return {
+        "price_type": "flat",
+        "amount": {"value": str(amount_in_cents), "currency_code": "USD"},
+    }
+
+
+def _flat_price_in_cents(price: Any) -> int | None:
+    if price is None or getattr(price, "package_units", None) is not None:
+        return None
+    if getattr(price, "price_type", None) not in (None, "flat"):
+        return None
+    return int(float(price.amount.value))
+
+
+def _rate_card_signature_from_spec(
+    rate_card_spec: Dict[str, Any], pricing_metric_id: str
+) -> RateCardSignature:
+    return (
+        rate_card_spec["name"],
+        rate_card_spec["description"],
+        rate_card_spec["billing_interval"],
+        tuple(
+            sorted(
+                (fixed_rate["code"], fixed_rate["name"], fixed_rate["amount_in_cents"])
+                for fixed_rate in rate_card_spec["fixed_rates"]
+            )
+        ),
+        tuple(
+            sorted(
+                (
+                    usage_rate["code"],
+                    usage_rate["name"],
+                    usage_rate["included_units"],
+                    pricing_metric_id,
+                    usage_rate["per_unit_amount_in_cents"],
+                )
+                for usage_rate in rate_card_spec["usage_based_rates"]
+            )
+        ),
     )
-    lark_pricing_plan_generator.create_starter_plan_rate_card(
-        pricing_metric_id=pricing_metric.id
+
+
+def _rate_card_signature_from_lark(rate_card: Any) -> RateCardSignature | None:
+    """Signature of an existing rate card, None if it can't match any spec.
+
+    Specs only describe flat prices and simple usage rates, so rate cards with
+    package prices or dimensional rates are never a match.
+    """
+    fixed_rates = []
+    for fixed_rate in rate_card.fixed_rates or []:
+        amount_in_cents = _flat_price_in_cents(fixed_rate.price)
+        if amount_in_cents is None:
+            return None
+        fixed_rates.append((fixed_rate.code, fixed_rate.name, amount_in_cents))
+
+    usage_rates = []
+    for usage_rate in rate_card.usage_based_rates or []:
+        if getattr(usage_rate, "usage_based_rate_type", None) == "dimensional":
+            return None
+        per_unit_amount_in_cents = _flat_price_in_cents(
+            getattr(usage_rate, "price", None)
+        )
+        if per_unit_amount_in_cents is None:
+            return None
+        usage_rates.append(
+            (
+                usage_rate.code,
+                usage_rate.name,
+                int(usage_rate.included_units),
+                usage_rate.pricing_metric_id,
+                per_unit_amount_in_cents,
+            )
+        )
+
+    return (
+        rate_card.name,
+        rate_card.description,
+        rate_card.billing_interval,
+        tuple(sorted(fixed_rates)),
+        tuple(sorted(usage_rates)),
+    )
+
+
+async def run(plan_spec_path: str, dry_run: bool):
+    assert LARK_API_KEY is not None
+    lark = AsyncLark(
+        api_key=LARK_API_KEY,
+        base_url=LARK_BASE_URL if LARK_BASE_URL else None,
     )
-    lark_pricing_plan_generator.create_premium_plan_rate_card(
-        pricing_metric_id=pricing_metric.id
+    with open(plan_spec_path, "r") as f:
+        plan_spec = json.load(f)
+
+    env = await LarkPricingPlanProvisioner(lark, plan_spec).provision(dry_run=dry_run)
+
+    # Rate card ids also go in frontend/.env with a VITE_ prefix
+    print("\nProvisioned environment:")
+    for env_var, value in env.items():
+        print(f'{env_var}="{value}"')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Provision Lark pricing plans from a plan spec"
     )
+    parser.add_argument("--spec", default=DEFAULT_PLAN_SPEC_PATH)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args.spec, args.dry_run))
@@ -0,0 +1,231 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from typing import Any, Dict, Tuple
+
+from dotenv import load_dotenv
+from pydantic import BaseModel
+from upstash_redis import Redis
+
+from billing.billing_manager import BillingManager
+from metrics import metrics
+
+load_dotenv()
+redis = Redis.from_env()
+
+LARK_WEBHOOKS_ENABLED = os.getenv("LARK_WEBHOOKS_ENABLED", "false").lower() == "true"
+LARK_WEBHOOK_SECRET = os.getenv("LARK_WEBHOOK_SECRET")
+# Other serving workers can see a subject's old state for up to this long
+SUBSCRIPTION_STATE_CACHE_TTL_SECONDS = float(
+    os.getenv("SUBSCRIPTION_STATE_CACHE_TTL_SECONDS") or 5
+)
+SUBSCRIPTION_RECONCILE_INTERVAL_SECONDS = float(
+    os.getenv("SUBSCRIPTION_RECONCILE_INTERVAL_SECONDS") or 300
+)
+
+SUBSCRIPTION_STATE_KEY_PREFIX = "subscription_state:"
+# Used units live in their own counter so usage deltas are atomic increments
+USED_UNITS_KEY_PREFIX = "subscription_state_used_units:"
+APPLIED_USAGE_KEY_PREFIX = "subscription_state_applied_usage:"
+# Lark stops redelivering a webhook well before this
+APPLIED_USAGE_TTL_SECONDS = 7 * 24 * 60 * 60
+KNOWN_SUBJECTS_KEY = "subscription_state_subjects"
+RECONCILER_LOCK_KEY = "subscription_state_reconciler_lock"
+
+
+class SubscriptionState(BaseModel):
+    subject_id: str
+    subscription_id: str
+    rate_card_id: str
+    included_units: int
+    used_units: int
+    updated_at: float
+
+    @property
+    def credits_remaining(self) -> int:
+        return self.included_units - self.used_units
+
+
+class InvalidWebhookSignature(Exception):
+    pass
+
+
+class SubscriptionStateStore:
+    """Local copy of each subject's plan and usage, fed by Lark webhooks.
+
+    Reads are served from an in-process cache backed by Redis, so Lark is
+    only called on a cold miss. Usage we report ourselves is applied right
+    away and each usage delta is applied at most once per idempotency key, so
+    the webhook for our own usage and redelivered webhooks don't double count.
+    A periodic reconciler re-reads every known subject from Lark to repair
+    any missed or out-of-order events.
+    """
+
+    def __init__(self, billing_manager: BillingManager):
+        self.billing_manager = billing_manager
+        self._cache: Dict[str, Tuple[float, SubscriptionState]] = {}
+
+    def verify_webhook_signature(self, payload: bytes, signature: str | None):
+        if not LARK_WEBHOOK_SECRET:
+            # Never accept unsigned events, they can rewrite anyone's usage
+            raise InvalidWebhookSignature("Webhook secret is not configured")
+        expected = hmac.new(
+            LARK_WEBHOOK_SECRET.encode(), payload, hashlib.sha256
+        ).hexdigest()
+        if not signature or not hmac.compare_digest(expected, signature):
+            raise InvalidWebhookSignature("Invalid webhook signature")
+
+    async def ingest_event(self, event: Dict[str, Any]):
+        event_type = event.get("type", "")
+        data = event.get("data") or {}
+        subject_id = data.get("subject_external_id") or data.get("subject_id")
+        if not subject_id:
+            metrics.increment("subscription_state.events_ignored")
+            return
+
+        metrics.increment(f"subscription_state.events.{event_type}")
+        self._cache.pop(subject_id, None)
+        if event_type.startswith("subscription."):
+            # Plan changes also change included units, which only Lark knows,
+            # so re-read the subject rather than patching the state by hand
+            await self.refresh(subject_id)
+        elif event_type.startswith("usage_event."):
+            # Usage we reported ourselves carries our idempotency key, which
+            # record_usage has already applied
+            idempotency_key = data.get("idempotency_key") or event.get("id")
+            if not idempotency_key:
+                await self.refresh(subject_id)
+                return
+            await self.record_usage(
+                subject_id,
+                int((data.get("data") or {}).get("value", 1)),
+                idempotency_key,
+            )
+        else:
+            metrics.increment("subscription_state.events_ignored")
+
+    async def record_usage(self, subject_id: str, units: int, idempotency_key: str):
+        """Add usage to the subject's state, at most once per idempotency key."""
+        applied_usage_key = APPLIED_USAGE_KEY_PREFIX + idempotency_key
+        claimed = await asyncio.to_thread(
+            redis.set, applied_usage_key, "1", nx=True, ex=APPLIED_USAGE_TTL_SECONDS
+        )
+        if not claimed:
+            metrics.increment("subscription_state.duplicate_usage")
+            return
+
+        try:
+            if await self._load(subject_id) is None:
+                await self.refresh(subject_id)
+                return
+            await asyncio.to_thread(
+                redis.incrby, USED_UNITS_KEY_PREFIX + subject_id, units
+            )
+            self._cache.pop(subject_id, None)
+        except Exception:
+            # Let a retry or redelivery apply it
+            await asyncio.to_thread(redis.delete, applied_usage_key)
+            raise
+
+    async def get(self, subject_id: str) -> SubscriptionState:
+        cached = self._cache.get(subject_id)
+        if (
+            cached
+            and time.monotonic() - cached[0] < SUBSCRIPTION_STATE_CACHE_TTL_SECONDS
+        ):
+            metrics.increment("subscription_state.cache_hits")
+            return cached[1]
+
+        state = await self._load(subject_id)
+        if state is None:
+            metrics.increment("subscription_state.cold_misses")
+            state = await self.refresh(subject_id)
+        self._cache[subject_id] = (time.monotonic(), state)
+        return state
+
+    async def refresh(self, subject_id: str) -> SubscriptionState:
+        billing_state = await asyncio.to_thread(
+            self.billing_manager.retrieve_billing_state, subject_id
+        )
+        state = SubscriptionState(
+            subject_id=subject_id,
+            subscription_id=billing_state.subscription_id,
+            rate_card_id=billing_state.rate_card_id,
+            included_units=billing_state.included_units,
+            used_units=billing_state.used_units,
+            updated_at=time.time(),
+        )
+        await self._save(state)
+        return state
+
+    async def invalidate(self, subject_id: str):
+        """Drop the stored state so the next read re-reads Lark."""
+        self._cache.pop(subject_id, None)
+        await asyncio.to_thread(
+            redis.delete,
+            SUBSCRIPTION_STATE_KEY_PREFIX + subject_id,
+            USED_UNITS_KEY_PREFIX + subject_id,
+        )
+
+    async def reconcile(self):
+        subject_ids = await asyncio.to_thread(redis.smembers, KNOWN_SUBJECTS_KEY)
+        repaired = 0
+        for subject_id in subject_ids:
+            stored = await self._load(subject_id)
+            try:
+                fresh = await self.refresh(subject_id)
+            except Exception as e:
+                print(f"Failed to reconcile subscription state for {subject_id}: {e}")
+                continue
+            if stored is None or (
+                stored.rate_card_id,
+                stored.subscription_id,
+                stored.used_units,
+            ) != (fresh.rate_card_id, fresh.subscription_id, fresh.used_units):
+                repaired += 1
+        metrics.increment("subscription_state.reconciler_repairs", repaired)
+        metrics.set_gauge("subscription_state.known_subjects", len(subject_ids))
+
+    async def run_reconciler(self):
+        while True:
+            await asyncio.sleep(SUBSCRIPTION_RECONCILE_INTERVAL_SECONDS)
+            try:
+                # Every serving worker runs this loop, only one should reconcile
+                # per interval
+                acquired = await asyncio.to_thread(
+                    redis.set,
+                    RECONCILER_LOCK_KEY,
+                    str(os.getpid()),
+                    nx=True,
+                    ex=int(SUBSCRIPTION_RECONCILE_INTERVAL_SECONDS),
+                )
+                if acquired:
+                    await self.reconcile()
+            except Exception as e:
+                print(f"Subscription state reconciliation failed: {e}")
+
+    async def _load(self, subject_id: str) -> SubscriptionState | None:
+        raw, used_units = await asyncio.to_thread(
+            redis.mget,
+            SUBSCRIPTION_STATE_KEY_PREFIX + subject_id,
+            USED_UNITS_KEY_PREFIX + subject_id,
+        )
+        if raw is None:
+            return None
+        state = SubscriptionState.model_validate_json(raw)
+        if used_units is not None:
+            state.used_units = int(used_units)
+        return state
+
+    async def _save(self, state: SubscriptionState):
+        transaction = redis.multi()
+        transaction.set(
+            SUBSCRIPTION_STATE_KEY_PREFIX + state.subject_id,
+            state.model_dump_json(),
+        )
+        transaction.set(USED_UNITS_KEY_PREFIX + state.subject_id, state.used_units)
+        transaction.sadd(KNOWN_SUBJECTS_KEY, state.subject_id)
+        await asyncio.to_thread(transaction.exec)
+        self._cache[state.subject_id] = (time.monotonic(), state)
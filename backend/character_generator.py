@@ -1,22 +1,51 @@
 import asyncio
 import json
 import os
+import random
 import re
+import time
 from enum import Enum
+from urllib.parse import urlparse
 import uuid
 from fastapi import HTTPException
 from upstash_redis import Redis
-from typing import List, Literal, Type
+from typing import List, Literal, Tuple, Type
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 from pydantic import BaseModel, create_model
 
+from cpu_pool import run_on_text
+from generation_cache import GenerationCache, canonicalize_url, simhash
+from llm_hedging import HedgedRequester
+from metrics import trace_span
 from website_scraper import WebsiteScraper, YCCompanyInfo
 
 load_dotenv()
 client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 redis = Redis.from_env()
 
+LLM_MODEL = "gpt-4.1-nano"
+LLM_HEDGING_ENABLED = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE") or 0.95)
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE") or 0.1)
+LLM_HEDGE_FALLBACK_MODEL = os.getenv("LLM_HEDGE_FALLBACK_MODEL") or None
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS") or 30)
+
+# How long mirrors and near duplicates of a general url share one generation,
+# 0 turns the cache off
+GENERATION_CACHE_TTL_SECONDS = int(os.getenv("GENERATION_CACHE_TTL_SECONDS") or 86400)
+
+LATEST_GENERATION_KEY_PREFIX = "latest_generation:"
+LATEST_GENERATION_TTL_SECONDS = 7 * 24 * 60 * 60
+
+USER_GENERATIONS_KEY_PREFIX = "user_generations:"
+# Generations and their history entries are kept forever unless this is set
+GENERATION_RETENTION_SECONDS = (
+    float(os.getenv("GENERATION_RETENTION_DAYS")) * 24 * 60 * 60
+    if os.getenv("GENERATION_RETENTION_DAYS")
+    else None
+)
+
 
 class YCFoudnerInfo(BaseModel):
     name: str
@@ -51,6 +80,11 @@ class CompanyVibesCharacterInfo(BaseModel):
     reasoning: str
 
 
+class GenerationHistoryPage(BaseModel):
+    generations: List[CompanyCharacterInfo | CompanyVibesCharacterInfo]
+    next_cursor: str | None
+
+
 class CharacterGenerator:
     def __init__(self):
         self.character_list: List[Character] = self._get_character_list()
@@ -58,23 +92,77 @@ class CharacterGenerator:
         self.character_name_to_image_url = {
             char.name: char.image_url for char in self.character_list
         }
+        self.hedged_requester = HedgedRequester(
+            name="llm_hedging",
+            enabled=LLM_HEDGING_ENABLED,
+            hedge_percentile=LLM_HEDGE_PERCENTILE,
+            deadline_seconds=LLM_DEADLINE_SECONDS,
+            max_hedge_rate=LLM_HEDGE_MAX_RATE,
+            fallback_model=LLM_HEDGE_FALLBACK_MODEL,
+        )
+        self.generation_cache = GenerationCache(
+            redis, ttl_seconds=GENERATION_CACHE_TTL_SECONDS
+        )
 
     async def generate_characters_for_company(
         self, company_url: str, mode: Literal["yc_company", "any_url"]
-    ) -> CompanyVibesCharacterInfo | CompanyCharacterInfo:
+    ) -> Tuple[CompanyVibesCharacterInfo | CompanyCharacterInfo, bool]:
+        """Generate characters for the url.
+
+        Also returns whether the generation was served from the generation
+        cache, in which case the LLM wasn't called.
+        """
         if mode == "yc_company":
-            return await self.generate_characters_for_yc_company(company_url)
+            return await self.generate_characters_for_yc_company(company_url), False
         elif mode == "any_url":
             return await self.generate_characters_for_url(company_url)
 
     async def generate_characters_for_url(
         self, company_url: str
-    ) -> CompanyVibesCharacterInfo:
-        raw_text = await self.website_scraper.extract_general_url_data_using_http(
-            company_url
+    ) -> Tuple[CompanyVibesCharacterInfo, bool]:
+        if self.generation_cache.enabled:
+            # Tracking params, www. and http vs https variants of a url we've
+            # seen don't even need a scrape
+            cached_generation = await self._get_cached_vibes_generation(
+                await self.generation_cache.get_by_url(company_url)
+            )
+            if cached_generation:
+                return cached_generation, True
+
+        general_url_data = (
+            await self.website_scraper.extract_general_url_data_using_http(company_url)
         )
+        cache_urls = [company_url, general_url_data.url]
+        # A guess from the url alone (site down, bot wall) must not be served
+        # to everyone else who asks for the url
+        cache_enabled = self.generation_cache.enabled and general_url_data.extracted
+        # Hashing every shingle is pure Python, so keep it off the event loop
+        fingerprint = (
+            await run_on_text(simhash, general_url_data.raw_text)
+            if cache_enabled
+            else None
+        )
+
+        if cache_enabled:
+            # Redirects land on a url we may know, mirrors on content we may know
+            generation_id = None
+            if canonicalize_url(general_url_data.url) != canonicalize_url(company_url):
+                generation_id = await self.generation_cache.get_by_url(
+                    general_url_data.url
+                )
+            if generation_id is None and fingerprint is not None:
+                generation_id = await self.generation_cache.get_by_fingerprint(
+                    fingerprint
+                )
+            cached_generation = await self._get_cached_vibes_generation(generation_id)
+            if cached_generation:
+                await self.generation_cache.store(
+                    cached_generation.id, cache_urls, None
+                )
+                return cached_generation, True
+
         company_character_internal = await self._assign_characters_to_general_url(
-            company_url, raw_text
+            company_url, general_url_data.raw_text
         )
 
         company_name = company_character_internal.company_name
@@ -88,8 +176,11 @@ class CharacterGenerator:
             character_image_url=self.character_name_to_image_url[character_name],
             reasoning=reasoning,
         )
-        await self._persist_character_generation(company_vibes_character_info)
-        return company_vibes_character_info
+        if cache_enabled:
+            await self.generation_cache.store(
+                company_vibes_character_info.id, cache_urls, fingerprint
+            )
+        return company_vibes_character_info, False
 
     async def generate_characters_for_yc_company(
         self, company_url: str
@@ -129,7 +220,6 @@ class CharacterGenerator:
             company_yc_url=company_url,
             characters=company_characters_external,
         )
-        await self._persist_character_generation(company_characters_info)
         return company_characters_info
 
     async def get_character_generation(
@@ -137,42 +227,244 @@ class CharacterGenerator:
     ) -> CompanyCharacterInfo | CompanyVibesCharacterInfo:
         return await self._get_character_generation(generation_id)
 
-    async def _persist_character_generation(
-        self, company_characters_info: CompanyCharacterInfo | CompanyVibesCharacterInfo
-    ):
-        redis.set(
+    async def persist_character_generation(
+        self,
+        company_characters_info: CompanyCharacterInfo | CompanyVibesCharacterInfo,
+        company_url: str,
+        mode: Literal["yc_company", "any_url"],
+        subject_id: str,
+    ) -> str:
+        """Serialize and store a generation, returning the serialized JSON.
+
+        The JSON is reused as the response body so it is only dumped once.
+        """
+        with trace_span("serialize"):
+            company_characters_json = company_characters_info.model_dump_json()
+        await self._persist_character_generation(
             company_characters_info.id,
-            company_characters_info.model_dump_json(),
+            company_characters_json,
+            company_url,
+            mode,
+            subject_id,
         )
+        return company_characters_json
+
+    async def get_generation_history(
+        self, subject_id: str, cursor: str | None, limit: int
+    ) -> GenerationHistoryPage:
+        """Return a page of the user's generations, newest first.
+
+        The cursor is the `score:generation_id` of the last generation on the
+        previous page, so each page is a range lookup on the user's index plus
+        one multi-get for the records. Generations stored in the same instant
+        share a score, so those up to and including the cursor's generation
+        are skipped rather than the whole score.
+        """
+        if cursor:
+            try:
+                cursor_score, cursor_generation_id = cursor.split(":", 1)
+                cursor_score = float(cursor_score)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            max_score = repr(cursor_score)
+        else:
+            max_score = "+inf"
+        min_score = (
+            time.time() - GENERATION_RETENTION_SECONDS
+            if GENERATION_RETENTION_SECONDS
+            else "-inf"
+        )
+
+        entries = []
+        offset = 0
+        while True:
+            batch = await asyncio.to_thread(
+                redis.zrange,
+                USER_GENERATIONS_KEY_PREFIX + subject_id,
+                max_score,
+                min_score,
+                sortby="BYSCORE",
+                rev=True,
+                offset=offset,
+                # One extra to know whether there is another page
+                count=limit + 1,
+                withscores=True,
+            )
+            offset += len(batch)
+            # Equal scores come back in reverse generation id order
+            entries.extend(
+                (generation_id, score)
+                for generation_id, score in batch
+                if not cursor
+                or score < cursor_score
+                or generation_id < cursor_generation_id
+            )
+            if len(entries) > limit or len(batch) <= limit:
+                break
+
+        page_entries = entries[:limit]
+        next_cursor = (
+            f"{page_entries[-1][1]!r}:{page_entries[-1][0]}"
+            if len(entries) > limit
+            else None
+        )
+        if not page_entries:
+            return GenerationHistoryPage(generations=[], next_cursor=None)
+
+        company_characters_jsons = await asyncio.to_thread(
+            redis.mget, *[generation_id for generation_id, _ in page_entries]
+        )
+        return GenerationHistoryPage(
+            generations=[
+                self._parse_character_generation(company_characters_json)
+                for company_characters_json in company_characters_jsons
+                # Records can expire slightly before their index entry is trimmed
+                if company_characters_json
+            ],
+            next_cursor=next_cursor,
+        )
+
+    async def get_degraded_generation(
+        self,
+        company_url: str,
+        mode: Literal["yc_company", "any_url"],
+        subject_id: str,
+    ) -> str | None:
+        """Return a generation for the url without calling the LLM.
+
+        Serves the latest stored generation for the url if there is one. For
+        general urls we otherwise fall back to a pre-canned result, YC
+        companies need founder names from the LLM so there is no fallback.
+        """
+        generation_id = await asyncio.to_thread(
+            redis.get, self._latest_generation_key(company_url, mode)
+        )
+        if generation_id:
+            company_characters_json = await asyncio.to_thread(redis.get, generation_id)
+            if company_characters_json:
+                # Persisted again, like a generation cache hit, so it is added
+                # to the caller's history
+                return await self.persist_character_generation(
+                    self._parse_character_generation(company_characters_json),
+                    company_url,
+                    mode,
+                    subject_id,
+                )
+
+        if mode == "yc_company":
+            return None
+
+        character = random.choice(self.character_list)
+        company_vibes_character_info = CompanyVibesCharacterInfo(
+            id=uuid.uuid4().hex,
+            company_name=urlparse(company_url).hostname.removeprefix("www."),
+            character_name=character.name,
+            character_image_url=character.image_url,
+            reasoning="Our AI is catching its breath after a busy day, so this match was made on pure vibes. Give it another spin in a bit for a proper roast!",
+        )
+        # Stored like any other generation so it shows up in history and
+        # follows the retention policy
+        return await self.persist_character_generation(
+            company_vibes_character_info, company_url, mode, subject_id
+        )
+
+    async def _persist_character_generation(
+        self,
+        generation_id: str,
+        company_characters_json: str,
+        company_url: str,
+        mode: Literal["yc_company", "any_url"],
+        subject_id: str,
+    ):
+        now = time.time()
+        user_generations_key = USER_GENERATIONS_KEY_PREFIX + subject_id
+        with trace_span("persist"):
+            # Record and history index are written in one transaction so a
+            # listed generation always exists
+            transaction = redis.multi()
+            if GENERATION_RETENTION_SECONDS:
+                transaction.set(
+                    generation_id,
+                    company_characters_json,
+                    ex=int(GENERATION_RETENTION_SECONDS),
+                )
+                transaction.zadd(user_generations_key, {generation_id: now})
+                # Drop index entries whose records have expired
+                transaction.zremrangebyscore(
+                    user_generations_key, "-inf", now - GENERATION_RETENTION_SECONDS
+                )
+                transaction.expire(
+                    user_generations_key, int(GENERATION_RETENTION_SECONDS)
+                )
+            else:
+                transaction.set(generation_id, company_characters_json)
+                transaction.zadd(user_generations_key, {generation_id: now})
+            # Lets degraded mode serve a previous result for the same url
+            transaction.set(
+                self._latest_generation_key(company_url, mode),
+                generation_id,
+                ex=LATEST_GENERATION_TTL_SECONDS,
+            )
+            await asyncio.to_thread(transaction.exec)
+
+    def _latest_generation_key(
+        self, company_url: str, mode: Literal["yc_company", "any_url"]
+    ) -> str:
+        return f"{LATEST_GENERATION_KEY_PREFIX}{mode}:{company_url}"
+
+    async def _get_cached_vibes_generation(
+        self, generation_id: str | None
+    ) -> CompanyVibesCharacterInfo | None:
+        if not generation_id:
+            return None
+        # The cache can point at a generation that isn't persisted yet
+        company_characters_json = await asyncio.to_thread(redis.get, generation_id)
+        if not company_characters_json:
+            return None
+        generation = self._parse_character_generation(company_characters_json)
+        if not isinstance(generation, CompanyVibesCharacterInfo):
+            return None
+        return generation
 
     async def _get_character_generation(
         self, generation_id: str
     ) -> CompanyCharacterInfo | CompanyVibesCharacterInfo:
         company_characters_info = redis.get(generation_id)
         if company_characters_info:
-            # Parse JSON to determine which type it is
-            data = json.loads(company_characters_info)
-            # CompanyCharacterInfo has 'characters' field, CompanyVibesCharacterInfo has 'character_name'
-            if "characters" in data:
-                return CompanyCharacterInfo.model_validate_json(company_characters_info)
-            else:
-                return CompanyVibesCharacterInfo.model_validate_json(
-                    company_characters_info
-                )
+            return self._parse_character_generation(company_characters_info)
         else:
             raise HTTPException(
                 status_code=404, detail="Company character generation not found"
             )
 
+    def _parse_character_generation(
+        self, company_characters_json: str
+    ) -> CompanyCharacterInfo | CompanyVibesCharacterInfo:
+        # Parse JSON to determine which type it is
+        data = json.loads(company_characters_json)
+        # CompanyCharacterInfo has 'characters' field, CompanyVibesCharacterInfo has 'character_name'
+        if "characters" in data:
+            return CompanyCharacterInfo.model_validate_json(company_characters_json)
+        else:
+            return CompanyVibesCharacterInfo.model_validate_json(
+                company_characters_json
+            )
+
     async def _assign_characters_to_general_url(
         self, company_url: str, raw_text_from_url: str
     ) -> List[BaseModel]:
         CompanyCharacterInternal = self._create_url_character_internal_model()
-        response = await client.responses.parse(
-            model="gpt-4.1-nano",
-            input=self._make_general_url_prompt_message(company_url, raw_text_from_url),
-            text_format=CompanyCharacterInternal,
-        )
+        with trace_span("llm"):
+            response = await self.hedged_requester.run(
+                lambda model: client.responses.parse(
+                    model=model,
+                    input=self._make_general_url_prompt_message(
+                        company_url, raw_text_from_url
+                    ),
+                    text_format=CompanyCharacterInternal,
+                ),
+                model=LLM_MODEL,
+            )
         print("Company character for generic url: ", response.output_parsed)
         return response.output_parsed
 
@@ -181,11 +473,15 @@ class CharacterGenerator:
     ) -> List[BaseModel]:
         CompanyCharactersInternal = self._create_founder_characters_internal_model()
 
-        response = await client.responses.parse(
-            model="gpt-4.1-nano",
-            input=self._make_yc_prompt_message(company_info),
-            text_format=CompanyCharactersInternal,
-        )
+        with trace_span("llm"):
+            response = await self.hedged_requester.run(
+                lambda model: client.responses.parse(
+                    model=model,
+                    input=self._make_yc_prompt_message(company_info),
+                    text_format=CompanyCharactersInternal,
+                ),
+                model=LLM_MODEL,
+            )
         print("Company characters: ", response.output_parsed)
         return response.output_parsed
 
@@ -0,0 +1,115 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, TypeVar
+
+from metrics import metrics
+
+T = TypeVar("T")
+
+# 0 keeps CPU work on the event loop, which is what a single dev server wants
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS") or 0)
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def configure_cpu_pool(workers: int):
+    """Resize the CPU pool, 0 runs CPU work inline on the event loop."""
+    global CPU_POOL_WORKERS, _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+    CPU_POOL_WORKERS = workers
+
+
+def cpu_pool_enabled() -> bool:
+    return CPU_POOL_WORKERS > 0
+
+
+def _get_executor() -> ProcessPoolExecutor | None:
+    global _executor
+    if CPU_POOL_WORKERS <= 0:
+        return None
+    if _executor is None:
+        # Created lazily so each gunicorn worker owns its own pool. Forking a
+        # worker that already runs an event loop and to_thread threads can
+        # deadlock the children, so start them from a clean forkserver
+        _executor = ProcessPoolExecutor(
+            max_workers=CPU_POOL_WORKERS,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+    return _executor
+
+
+def _drop_executor(executor: ProcessPoolExecutor):
+    global _executor
+    # Concurrent tasks all see the same pool break, only the first one drops it
+    if _executor is executor:
+        _executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_on_html(
+    func: Callable[[str], T], content: bytes, encoding: str, *args: Any
+) -> T:
+    """Run `func(html, *args)` in the CPU pool.
+
+    The response bytes are handed to the pool through shared memory instead
+    of being pickled through the executor pipe, and are decoded straight from
+    the shared buffer on the other side. A pool whose process died is
+    replaced and the task retried once on the new pool.
+    """
+    executor = _get_executor()
+    if executor is None:
+        return func(content.decode(encoding, errors="replace"), *args)
+
+    shared_memory = SharedMemory(create=True, size=max(len(content), 1))
+    try:
+        shared_memory.buf[: len(content)] = content
+        for attempt in range(2):
+            submitted_at = time.monotonic()
+            try:
+                result = await asyncio.get_running_loop().run_in_executor(
+                    executor,
+                    _run_on_shared_html,
+                    func,
+                    shared_memory.name,
+                    len(content),
+                    encoding,
+                    args,
+                )
+            except BrokenProcessPool:
+                metrics.increment("cpu_pool.broken")
+                _drop_executor(executor)
+                if attempt == 1:
+                    raise
+                executor = _get_executor()
+                continue
+            metrics.observe("cpu_pool.task", time.monotonic() - submitted_at)
+            return result
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+
+
+async def run_on_text(func: Callable[[str], T], text: str, *args: Any) -> T:
+    """Run `func(text, *args)` in the CPU pool, for text that is already decoded."""
+    if not cpu_pool_enabled():
+        return func(text, *args)
+    return await run_on_html(func, text.encode(), "utf-8", *args)
+
+
+def _run_on_shared_html(
+    func: Callable[[str], T], name: str, size: int, encoding: str, args: tuple
+) -> T:
+    shared_memory = SharedMemory(name=name)
+    try:
+        with shared_memory.buf[:size] as shared_html:
+            html = str(shared_html, encoding, errors="replace")
+        return func(html, *args)
+    finally:
+        shared_memory.close()
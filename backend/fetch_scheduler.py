@@ -0,0 +1,321 @@
+import asyncio
+import ipaddress
+import socket
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import AsyncIterator, Deque, Dict, List, Tuple
+from urllib.robotparser import RobotFileParser
+
+import httpx
+
+from metrics import metrics
+from shared_cache import TwoTierCache
+
+USER_AGENT = "LarkVibesBot/1.0 (+https://vibes.uselark.ai)"
+ROBOTS_TXT_TTL_SECONDS = 24 * 60 * 60
+# A robots.txt we failed to fetch is retried after this, per worker
+ROBOTS_TXT_ERROR_RETRY_SECONDS = 5 * 60
+MAX_REDIRECTS = 5
+DISALLOW_ALL_ROBOTS_TXT = "User-agent: *\nDisallow: /"
+
+
+class RobotsDisallowed(Exception):
+    pass
+
+
+class DNSCache:
+    """Async DNS resolution with a TTL, coalescing concurrent lookups per host.
+
+    Every address a host resolves to is kept, in resolver order, so a fetch
+    can fall back to the next one when the first doesn't accept connections.
+    Hosts come from user-supplied urls, so at most `max_entries` addresses
+    are kept and the least recently used one is dropped first.
+    """
+
+    def __init__(self, ttl_seconds: float = 300, max_entries: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Tuple[str, int], Tuple[float, List[str]]] = (
+            OrderedDict()
+        )
+        self._inflight: Dict[Tuple[str, int], asyncio.Future] = {}
+
+    async def resolve(self, host: str, port: int) -> List[str]:
+        key = (host, port)
+        entry = self._entries.get(key)
+        if entry and time.monotonic() < entry[0]:
+            metrics.increment("fetch_scheduler.dns_cache_hits")
+            self._entries.move_to_end(key)
+            return entry[1]
+
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        metrics.increment("fetch_scheduler.dns_cache_misses")
+        lookup = asyncio.ensure_future(self._lookup(host, port))
+        self._inflight[key] = lookup
+        try:
+            addresses = await asyncio.shield(lookup)
+        finally:
+            self._inflight.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, addresses)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return addresses
+
+    async def _lookup(self, host: str, port: int) -> List[str]:
+        start = time.monotonic()
+        addresses = await asyncio.get_running_loop().getaddrinfo(
+            host, port, type=socket.SOCK_STREAM
+        )
+        metrics.observe("fetch_scheduler.dns_lookup", time.monotonic() - start)
+        # getaddrinfo repeats an address once per protocol
+        return list(dict.fromkeys(address[4][0] for address in addresses))
+
+
+class _HostState:
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.active = 0
+        self.robots: RobotFileParser | None = None
+        self.robots_expires_at = 0.0
+
+
+class FetchScheduler:
+    """Schedules outbound page fetches across hosts.
+
+    Each host gets its own pooled client and a fixed number of concurrency
+    slots. Global slots are handed out round-robin across hosts that have
+    waiting fetches, so one slow domain can't starve the others.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_concurrency: int = 32,
+        per_host_concurrency: int = 2,
+        dns_cache: DNSCache | None = None,
+        respect_robots_txt: bool = False,
+        robots_cache: TwoTierCache | None = None,
+        max_hosts: int = 256,
+    ):
+        self.max_concurrency = max_concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.dns_cache = dns_cache or DNSCache()
+        self.respect_robots_txt = respect_robots_txt
+        self.robots_cache = robots_cache or TwoTierCache(
+            "robots_txt", ttl_seconds=ROBOTS_TXT_TTL_SECONDS
+        )
+        self.max_hosts = max_hosts
+        self._hosts: OrderedDict[str, _HostState] = OrderedDict()
+        self._ready_hosts: Deque[str] = deque()
+        self._active = 0
+
+    @asynccontextmanager
+    async def stream(
+        self, url: str, follow_redirects: bool = False
+    ) -> AsyncIterator[httpx.Response]:
+        request_url = httpx.URL(url)
+        for _ in range(MAX_REDIRECTS + 1):
+            # Each hop waits for a slot on its own host
+            async with self._stream_once(request_url) as response:
+                if follow_redirects and response.has_redirect_location:
+                    metrics.increment("fetch_scheduler.redirects")
+                    request_url = response.url.join(response.headers["Location"])
+                    continue
+                yield response
+                return
+        raise httpx.TooManyRedirects(f"Exceeded {MAX_REDIRECTS} redirects for {url}")
+
+    @asynccontextmanager
+    async def _stream_once(
+        self, request_url: httpx.URL
+    ) -> AsyncIterator[httpx.Response]:
+        origin = f"{request_url.scheme}://{request_url.netloc.decode()}"
+        state = self._host_state(origin)
+
+        queued_at = time.monotonic()
+        await self._acquire(origin, state)
+        metrics.observe("fetch_scheduler.queue_wait", time.monotonic() - queued_at)
+        try:
+            if self.respect_robots_txt and not await self._allowed_by_robots(
+                state, origin, request_url
+            ):
+                metrics.increment("fetch_scheduler.robots_disallowed")
+                raise RobotsDisallowed(f"robots.txt disallows fetching {request_url}")
+
+            fetch_started_at = time.monotonic()
+            response = await self._send(state.client, request_url, stream=True)
+            try:
+                yield response
+            finally:
+                await response.aclose()
+                metrics.observe(
+                    "fetch_scheduler.fetch", time.monotonic() - fetch_started_at
+                )
+        finally:
+            self._release(state)
+
+    async def aclose(self):
+        for state in self._hosts.values():
+            await state.client.aclose()
+        self._hosts.clear()
+
+    async def _send(
+        self, client: httpx.AsyncClient, url: httpx.URL, *, stream: bool = False
+    ) -> httpx.Response:
+        if _is_ip_address(url.host):
+            return await client.send(client.build_request("GET", url), stream=stream)
+
+        # Connect to the cached addresses but keep the original host for the
+        # Host header and TLS verification
+        addresses = await self.dns_cache.resolve(
+            url.host, url.port or _default_port(url)
+        )
+        for index, address in enumerate(addresses):
+            request = client.build_request(
+                "GET",
+                url.copy_with(host=address),
+                headers={"Host": url.netloc.decode()},
+                extensions={"sni_hostname": url.host},
+            )
+            try:
+                response = await client.send(request, stream=stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                if index == len(addresses) - 1:
+                    raise
+                metrics.increment("fetch_scheduler.dns_address_fallbacks")
+                continue
+            # The request went to the resolved address, point it back at the
+            # real url so response.url and relative redirects use the host
+            request.url = url
+            return response
+
+    async def _allowed_by_robots(
+        self, state: _HostState, origin: str, url: httpx.URL
+    ) -> bool:
+        if state.robots is None or time.monotonic() >= state.robots_expires_at:
+            robots_ttl_seconds = ROBOTS_TXT_TTL_SECONDS
+            robots_txt = await self.robots_cache.get(origin)
+            if robots_txt is None:
+                robots_txt = await self._fetch_robots_txt(state, url)
+                if robots_txt is None:
+                    # A fetch error allows this fetch, but isn't shared with
+                    # other workers or kept for long
+                    robots_txt = ""
+                    robots_ttl_seconds = ROBOTS_TXT_ERROR_RETRY_SECONDS
+                else:
+                    await self.robots_cache.set(origin, robots_txt)
+            robots = RobotFileParser()
+            robots.parse(robots_txt.splitlines())
+            state.robots = robots
+            state.robots_expires_at = time.monotonic() + robots_ttl_seconds
+        return state.robots.can_fetch(USER_AGENT, str(url))
+
+    async def _fetch_robots_txt(self, state: _HostState, url: httpx.URL) -> str | None:
+        """Fetch robots.txt, None if it couldn't be fetched."""
+        try:
+            response = await self._send(state.client, url.join("/robots.txt"))
+        except httpx.HTTPError:
+            metrics.increment("fetch_scheduler.robots_fetch_errors")
+            return None
+        if response.status_code in (401, 403):
+            return DISALLOW_ALL_ROBOTS_TXT
+        elif response.status_code >= 400:
+            # A missing robots.txt allows everything
+            return ""
+        return response.text
+
+    def _host_state(self, origin: str) -> _HostState:
+        state = self._hosts.get(origin)
+        if state is None:
+            self._evict_idle_hosts()
+            state = _HostState(
+                httpx.AsyncClient(
+                    headers={"User-Agent": USER_AGENT},
+                    # Clients are shared by every user fetching from the host,
+                    # so cookies one fetch gets must never be sent on another
+                    cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+                    limits=httpx.Limits(
+                        max_connections=self.per_host_concurrency,
+                        max_keepalive_connections=self.per_host_concurrency,
+                    ),
+                )
+            )
+            self._hosts[origin] = state
+        self._hosts.move_to_end(origin)
+        return state
+
+    def _evict_idle_hosts(self):
+        for origin in list(self._hosts):
+            if len(self._hosts) < self.max_hosts:
+                return
+            state = self._hosts[origin]
+            if (
+                state.active == 0
+                and not state.waiters
+                and origin not in self._ready_hosts
+            ):
+                del self._hosts[origin]
+                asyncio.create_task(state.client.aclose())
+
+    async def _acquire(self, origin: str, state: _HostState):
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        if origin not in self._ready_hosts:
+            self._ready_hosts.append(origin)
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # The slot may have been granted just before we were cancelled
+            if waiter.done() and not waiter.cancelled():
+                self._release(state)
+            raise
+
+    def _release(self, state: _HostState):
+        state.active -= 1
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        checked = 0
+        while self._active < self.max_concurrency and checked < len(self._ready_hosts):
+            origin = self._ready_hosts[0]
+            self._ready_hosts.rotate(-1)
+            state = self._hosts[origin]
+            while state.waiters and state.waiters[0].done():
+                state.waiters.popleft()
+            if not state.waiters:
+                self._ready_hosts.remove(origin)
+                continue
+            if state.active >= self.per_host_concurrency:
+                checked += 1
+                continue
+
+            state.waiters.popleft().set_result(None)
+            state.active += 1
+            self._active += 1
+            checked = 0
+
+        metrics.set_gauge("fetch_scheduler.active", self._active)
+        metrics.set_gauge(
+            "fetch_scheduler.queued",
+            sum(len(self._hosts[origin].waiters) for origin in self._ready_hosts),
+        )
+
+
+def _is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def _default_port(url: httpx.URL) -> int:
+    return 443 if url.scheme == "https" else 80
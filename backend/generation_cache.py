@@ -0,0 +1,167 @@
+import asyncio
+import hashlib
+import re
+import time
+from collections import Counter
+from typing import List
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from upstash_redis import Redis
+
+from metrics import metrics
+
+GENERATION_CACHE_KEY_PREFIX = "generation_cache:"
+
+TRACKING_QUERY_PARAMS = {
+    "fbclid",
+    "gclid",
+    "dclid",
+    "msclkid",
+    "yclid",
+    "mc_cid",
+    "mc_eid",
+    "igshid",
+    "ref",
+    "ref_src",
+    "_hsenc",
+    "_hsmi",
+}
+
+SIMHASH_BITS = 64
+# Pages whose fingerprints differ in at most this many bits count as the same
+SIMHASH_MAX_DISTANCE = 3
+# Split into more bands than the allowed distance so that any near duplicate
+# shares at least one band exactly (pigeonhole), which makes lookups exact
+# matches instead of a scan
+SIMHASH_BANDS = SIMHASH_MAX_DISTANCE + 1
+SIMHASH_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+# Short pages (bot challenges, parked domains, error pages) look alike across
+# unrelated sites, so they are never matched by content
+SIMHASH_MIN_WORDS = 50
+
+
+def canonicalize_url(url: str) -> str:
+    """Normalize a url so trivially different spellings share a cache key.
+
+    Scheme is dropped (http and https serve the same site in practice), the
+    host is lowercased without a leading www. or default port, tracking
+    params and fragments are removed, remaining params are sorted and an
+    empty path becomes "/".
+    """
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or "").lower().rstrip(".").removeprefix("www.")
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path or "/")
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not key.lower().startswith("utm_")
+            and key.lower() not in TRACKING_QUERY_PARAMS
+        )
+    )
+    return urlunsplit(("", host, path, query, "")).removeprefix("//")
+
+
+def simhash(text: str) -> int | None:
+    """64-bit SimHash of the text's word shingles, None for too little text."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SIMHASH_MIN_WORDS:
+        return None
+    shingles = Counter(" ".join(words[i : i + 3]) for i in range(len(words) - 2))
+
+    weights = [0] * SIMHASH_BITS
+    for shingle, count in shingles.items():
+        shingle_hash = int.from_bytes(
+            hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big"
+        )
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if shingle_hash >> bit & 1 else -count
+
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def _simhash_bands(fingerprint: int) -> List[int]:
+    mask = (1 << SIMHASH_BAND_BITS) - 1
+    return [
+        fingerprint >> (band * SIMHASH_BAND_BITS) & mask
+        for band in range(SIMHASH_BANDS)
+    ]
+
+
+class GenerationCache:
+    """Maps canonical urls and page fingerprints to an existing generation.
+
+    Mirrors, redirects and tracking-param variants of a general url resolve
+    to the same generation id, so viral shares of one page only hit the LLM
+    once per `ttl_seconds`.
+    """
+
+    def __init__(self, redis: Redis, ttl_seconds: int):
+        self.redis = redis
+        self.ttl_seconds = ttl_seconds
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0
+
+    async def get_by_url(self, url: str) -> str | None:
+        generation_id = await asyncio.to_thread(self.redis.get, self._url_key(url))
+        metrics.increment(
+            "generation_cache.url_hits"
+            if generation_id
+            else "generation_cache.url_misses"
+        )
+        return generation_id
+
+    async def get_by_fingerprint(self, fingerprint: int) -> str | None:
+        now = time.time()
+        pipeline = self.redis.pipeline()
+        for band, band_value in enumerate(_simhash_bands(fingerprint)):
+            # Members are scored by when they expire
+            pipeline.zrange(
+                self._band_key(band, band_value), now, "+inf", sortby="BYSCORE"
+            )
+        candidates = set().union(*await asyncio.to_thread(pipeline.exec))
+
+        best_generation_id = None
+        best_distance = SIMHASH_MAX_DISTANCE + 1
+        for candidate in candidates:
+            candidate_fingerprint, generation_id = candidate.split(":", 1)
+            distance = (int(candidate_fingerprint, 16) ^ fingerprint).bit_count()
+            if distance < best_distance:
+                best_generation_id, best_distance = generation_id, distance
+
+        metrics.increment(
+            "generation_cache.fingerprint_hits"
+            if best_generation_id
+            else "generation_cache.fingerprint_misses"
+        )
+        return best_generation_id
+
+    async def store(self, generation_id: str, urls: List[str], fingerprint: int | None):
+        pipeline = self.redis.pipeline()
+        for url in set(urls):
+            pipeline.set(self._url_key(url), generation_id, ex=self.ttl_seconds)
+        if fingerprint is not None:
+            # Each member expires on its own, so busy bands don't keep every
+            # old member alive by refreshing the key's TTL
+            now = time.time()
+            member = f"{fingerprint:016x}:{generation_id}"
+            for band, band_value in enumerate(_simhash_bands(fingerprint)):
+                band_key = self._band_key(band, band_value)
+                pipeline.zadd(band_key, {member: now + self.ttl_seconds})
+                pipeline.zremrangebyscore(band_key, "-inf", now)
+                pipeline.expire(band_key, self.ttl_seconds)
+        await asyncio.to_thread(pipeline.exec)
+
+    def _url_key(self, url: str) -> str:
+        return f"{GENERATION_CACHE_KEY_PREFIX}url:{canonicalize_url(url)}"
+
+    def _band_key(self, band: int, band_value: int) -> str:
+        return f"{GENERATION_CACHE_KEY_PREFIX}simhash:{band}:{band_value:04x}"
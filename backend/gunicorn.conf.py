@@ -0,0 +1,18 @@
+import multiprocessing
+import os
+
+# Production serving profile: `gunicorn main:app` from the backend directory.
+# Each worker is a separate uvicorn event loop. CPU heavy HTML parsing is
+# further offloaded to a per-worker process pool sized by CPU_POOL_WORKERS.
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("WEB_CONCURRENCY") or multiprocessing.cpu_count())
+worker_class = "uvicorn.workers.UvicornWorker"
+# LLM calls can take a while, don't let gunicorn kill workers mid generation
+timeout = int(os.getenv("GUNICORN_TIMEOUT") or 120)
+graceful_timeout = 30
+keepalive = 5
+# Not preloading: the OpenAI, Redis and httpx clients shouldn't be shared
+# across forked workers
+preload_app = False
+accesslog = "-"
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+from fastapi import HTTPException
+
+from metrics import metrics, percentile
+
+T = TypeVar("T")
+
+# Until we have seen this many calls we don't trust the latency percentile
+MIN_LATENCY_SAMPLES = 20
+
+
+class HedgedRequester:
+    """Runs an LLM call and fires a second (hedge) call if the first is slow.
+
+    The hedge delay is the configured percentile of recently observed
+    latencies. Whichever call finishes first wins and the other one is
+    cancelled. The share of calls allowed to hedge is capped so the extra
+    cost stays bounded. `deadline_seconds` caps every call, hedged or not.
+    """
+
+    def __init__(
+        self,
+        *,
+        name: str,
+        enabled: bool,
+        hedge_percentile: float = 0.95,
+        default_hedge_delay_seconds: float = 4.0,
+        deadline_seconds: float | None = None,
+        max_hedge_rate: float = 0.1,
+        fallback_model: str | None = None,
+        window_size: int = 200,
+    ):
+        self.name = name
+        self.enabled = enabled
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay_seconds = default_hedge_delay_seconds
+        self.deadline_seconds = deadline_seconds
+        self.max_hedge_rate = max_hedge_rate
+        self.fallback_model = fallback_model
+        self._latencies: deque[float] = deque(maxlen=window_size)
+        # One entry per recent call, True if that call fired a hedge
+        self._recent_hedges: deque[bool] = deque(maxlen=window_size)
+
+    async def run(self, call: Callable[[str], Awaitable[T]], model: str) -> T:
+        metrics.increment(f"{self.name}.requests")
+        try:
+            # The deadline applies whether or not hedging is on
+            async with asyncio.timeout(self.deadline_seconds):
+                if not self.enabled:
+                    return await call(model)
+                return await self._run_hedged(call, model)
+        except TimeoutError:
+            metrics.increment(f"{self.name}.deadline_exceeded")
+            raise HTTPException(
+                status_code=504,
+                detail=f"Character generation did not finish within {self.deadline_seconds}s. Please try again.",
+            )
+
+    async def _run_hedged(self, call: Callable[[str], Awaitable[T]], model: str) -> T:
+        start = time.monotonic()
+        primary = asyncio.create_task(call(model))
+        tasks = {primary: "primary"}
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self._hedge_delay())
+            hedged = not done and self._can_hedge()
+            self._recent_hedges.append(hedged)
+            if hedged:
+                metrics.increment(f"{self.name}.hedges_fired")
+                hedge = asyncio.create_task(call(self.fallback_model or model))
+                tasks[hedge] = "hedge"
+
+            pending = set(tasks)
+            first_error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # Read every finished task's error, not just the first, so a
+                # loser that failed in the same wakeup isn't logged as unhandled
+                errors = {task: task.exception() for task in done}
+                for task, error in errors.items():
+                    if error is None:
+                        self._record_win(tasks[task], time.monotonic() - start)
+                        return task.result()
+                    first_error = first_error or error
+
+            assert first_error is not None
+            raise first_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def _hedge_delay(self) -> float:
+        if len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return self.default_hedge_delay_seconds
+        return percentile(sorted(self._latencies), self.hedge_percentile)
+
+    def _can_hedge(self) -> bool:
+        if not self._recent_hedges:
+            return self.max_hedge_rate > 0
+        hedge_rate = sum(self._recent_hedges) / len(self._recent_hedges)
+        return hedge_rate < self.max_hedge_rate
+
+    def _record_win(self, winner: str, latency_seconds: float):
+        self._latencies.append(latency_seconds)
+        metrics.increment(f"{self.name}.{winner}_wins")
+        metrics.observe(f"{self.name}.latency", latency_seconds)
@@ -1,9 +1,12 @@
+import asyncio
+import hmac
 import os
 import re
 from urllib.parse import urlparse
 from asgi_correlation_id import CorrelationIdMiddleware
+from admission_control import AdmissionController, Priority
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Depends, Header, Request
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, field_validator, model_validator
 from typing import Literal, Optional
@@ -11,17 +14,30 @@ from stytch import Client
 from stytch.consumer.models.sessions import AuthenticateResponse
 from stytch.core.response_base import StytchError
 from billing.billing_manager import BillingManager, UpdateSubscriptionResponse
+from billing.subscription_state import (
+    LARK_WEBHOOK_SECRET,
+    LARK_WEBHOOKS_ENABLED,
+    InvalidWebhookSignature,
+    SubscriptionStateStore,
+)
 from character_generator import (
+    LLM_DEADLINE_SECONDS,
     CharacterGenerator,
     CompanyCharacterInfo,
     CompanyVibesCharacterInfo,
+    GenerationHistoryPage,
 )
+from metrics import metrics, start_trace, trace_span
+from request_dedup import GenerationRequestDeduplicator
+from website_scraper import SCRAPE_DEADLINE_SECONDS
 
 # Load environment variables from .env file
 load_dotenv()
 
 DASHBOARD_URL = os.getenv("DASHBOARD_URL")
 assert DASHBOARD_URL is not None
+# /api/metrics is only served to callers presenting this token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
 
 app = FastAPI(title="Lark Demo API")
 
@@ -44,14 +60,46 @@ if not STYTCH_PROJECT_ID or not STYTCH_SECRET or not STYCH_ENVIRONMENT:
         "STYTCH_PROJECT_ID and STYTCH_SECRET and STYCH_ENVIRONMENT must be set"
     )
 
+if LARK_WEBHOOKS_ENABLED and not LARK_WEBHOOK_SECRET:
+    raise ValueError("LARK_WEBHOOK_SECRET must be set when LARK_WEBHOOKS_ENABLED")
+
 stytch_client = Client(
     project_id=STYTCH_PROJECT_ID,
     secret=STYTCH_SECRET,
     environment=STYCH_ENVIRONMENT,
 )
 
+admission_controller = AdmissionController(
+    max_concurrency=int(os.getenv("ADMISSION_MAX_CONCURRENCY") or 64),
+    max_queue_depth=int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH") or 128),
+    max_queue_wait_seconds=float(os.getenv("ADMISSION_MAX_QUEUE_WAIT_SECONDS") or 10),
+    degrade_queue_wait_seconds=float(
+        os.getenv("ADMISSION_DEGRADE_QUEUE_WAIT_SECONDS") or 2
+    ),
+    recover_after_seconds=float(os.getenv("ADMISSION_RECOVER_AFTER_SECONDS") or 30),
+)
 character_generator = CharacterGenerator()
+generation_request_deduplicator = GenerationRequestDeduplicator(
+    # A claim has to outlive the run it guards: the admission queue wait, the
+    # scrape and the LLM call, plus a margin for persisting and billing
+    in_flight_ttl_seconds=admission_controller.max_queue_wait_seconds
+    + SCRAPE_DEADLINE_SECONDS
+    + LLM_DEADLINE_SECONDS
+    + 30,
+    admission_controller=admission_controller,
+    completed_ttl_seconds=float(
+        os.getenv("GENERATION_REQUEST_DEDUP_TTL_SECONDS") or 24 * 60 * 60
+    ),
+)
 billing_manager = BillingManager()
+subscription_state_store = SubscriptionStateStore(billing_manager)
+
+
+@app.on_event("startup")
+async def start_subscription_state_reconciler():
+    app.state.subscription_state_reconciler = asyncio.create_task(
+        subscription_state_store.run_reconciler()
+    )
 
 
 # Authentication dependency
@@ -97,7 +145,20 @@ async def health_check():
     return {"status": "healthy"}
 
 
-@app.post("/api/customers", response_model=str)
+@app.get("/api/metrics")
+async def get_metrics(x_metrics_token: Optional[str] = Header(None)):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_metrics_token or not hmac.compare_digest(x_metrics_token, METRICS_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return metrics.snapshot()
+
+
+@app.post(
+    "/api/customers",
+    response_model=str,
+    dependencies=[admission_controller.dependency("customers", Priority.NORMAL)],
+)
 async def create_customer(
     session: AuthenticateResponse = Depends(verify_session_token),
 ):
@@ -160,25 +221,92 @@ async def generate_company_characters(
     company_request: CompanyCharacterRequest,
     request: Request,
     session: AuthenticateResponse = Depends(verify_session_token),
-) -> CompanyCharacterInfo | CompanyVibesCharacterInfo:
-    company_characters = await character_generator.generate_characters_for_company(
-        company_request.company_url,
-        company_request.mode,
-    )
-
+) -> Response:
     request_id = request.headers.get("X-Request-ID")
     assert request_id is not None
-    billing_manager.report_usage(
-        subject_external_id=session.user.user_id,
-        usage=1,
-        idempotency_key=request_id,
+    # Retries with the same request id replay the original result
+    response_body = await generation_request_deduplicator.run(
+        subject_id=session.user.user_id,
+        request_id=request_id,
+        generate=lambda: _generate_company_characters(
+            company_request, session.user.user_id, request_id
+        ),
     )
-    return company_characters
+    return Response(content=response_body, media_type="application/json")
+
+
+async def _generate_company_characters(
+    company_request: CompanyCharacterRequest,
+    subject_external_id: str,
+    request_id: str,
+) -> str:
+    start_trace()
+    # Paid YC generations are the last thing we shed under overload
+    priority = Priority.HIGH if company_request.mode == "yc_company" else Priority.LOW
+    async with admission_controller.admit(
+        f"company_characters.{company_request.mode}", priority
+    ):
+        if admission_controller.degraded:
+            degraded_response_body = await character_generator.get_degraded_generation(
+                company_request.company_url,
+                company_request.mode,
+                subject_external_id,
+            )
+            if degraded_response_body is not None:
+                # Not billed since the LLM wasn't involved
+                metrics.increment("admission.degraded_responses")
+                return degraded_response_body
+
+        company_characters, cache_hit = (
+            await character_generator.generate_characters_for_company(
+                company_request.company_url,
+                company_request.mode,
+            )
+        )
+
+        response_body = await character_generator.persist_character_generation(
+            company_characters,
+            company_request.company_url,
+            company_request.mode,
+            subject_external_id,
+        )
+        if cache_hit:
+            # Not billed since the LLM wasn't involved
+            metrics.increment("generation_cache.unbilled_responses")
+            return response_body
+
+        # Only bill once the generation is stored, a failed write is a 500
+        await asyncio.to_thread(
+            _report_usage,
+            subject_external_id=subject_external_id,
+            idempotency_key=request_id,
+        )
+        # Keep the paywall in step without waiting for Lark's webhook. The
+        # user is already billed, so a failure here is left to the reconciler
+        try:
+            await subscription_state_store.record_usage(
+                subject_external_id, 1, idempotency_key=request_id
+            )
+        except Exception as e:
+            print(f"Failed to record usage for {subject_external_id}: {e}")
+        return response_body
+
+
+def _report_usage(subject_external_id: str, idempotency_key: str):
+    with trace_span("report_usage"):
+        billing_manager.report_usage(
+            subject_external_id=subject_external_id,
+            usage=1,
+            idempotency_key=idempotency_key,
+        )
 
 
 @app.get(
     "/api/company_characters/{generation_id}",
     response_model=CompanyCharacterInfo | CompanyVibesCharacterInfo,
+    dependencies=[
+        admission_controller.dependency("get_company_characters", Priority.LOW)
+    ],
 )
 async def get_company_characters(
     generation_id: str,
@@ -189,6 +317,23 @@ async def get_company_characters(
     return company_characters
 
 
+@app.get(
+    "/api/my_generations",
+    response_model=GenerationHistoryPage,
+    dependencies=[admission_controller.dependency("my_generations", Priority.NORMAL)],
+)
+async def get_my_generations(
+    cursor: Optional[str] = None,
+    limit: int = Query(default=20, ge=1, le=100),
+    session: AuthenticateResponse = Depends(verify_session_token),
+):
+    return await character_generator.get_generation_history(
+        subject_id=session.user.user_id,
+        cursor=cursor,
+        limit=limit,
+    )
+
+
 class UpdateSubscriptionRequest(BaseModel):
     subscription_id: str
     new_rate_card_id: str
@@ -196,7 +341,13 @@ class UpdateSubscriptionRequest(BaseModel):
     checkout_cancel_callback_url: str
 
 
-@app.post("/api/update_subscription", response_model=UpdateSubscriptionResponse)
+@app.post(
+    "/api/update_subscription",
+    response_model=UpdateSubscriptionResponse,
+    dependencies=[
+        admission_controller.dependency("update_subscription", Priority.NORMAL)
+    ],
+)
 async def update_subscription(
     update_subscription_request: UpdateSubscriptionRequest,
     session: AuthenticateResponse = Depends(verify_session_token),
@@ -207,6 +358,10 @@ async def update_subscription(
         checkout_success_callback_url=update_subscription_request.checkout_success_callback_url,
         checkout_cancel_callback_url=update_subscription_request.checkout_cancel_callback_url,
     )
+    if update_subscription_response.type == "success":
+        # The new plan changes included units, which only Lark knows, so the
+        # next read goes back to Lark
+        await subscription_state_store.invalidate(session.user.user_id)
     return update_subscription_response
 
 
@@ -218,7 +373,11 @@ class CustomerPortalSessionResponse(BaseModel):
     url: str
 
 
-@app.post("/api/customer_portal", response_model=CustomerPortalSessionResponse)
+@app.post(
+    "/api/customer_portal",
+    response_model=CustomerPortalSessionResponse,
+    dependencies=[admission_controller.dependency("customer_portal", Priority.NORMAL)],
+)
 async def create_customer_portal_session(
     customer_portal_request: CustomerPortalRequest,
     session: AuthenticateResponse = Depends(verify_session_token),
@@ -228,3 +387,56 @@ async def create_customer_portal_session(
         return_url=customer_portal_request.return_url,
     )
     return CustomerPortalSessionResponse(url=customer_portal_session_url)
+
+
+class SubscriptionStateResponse(BaseModel):
+    subscription_id: str
+    rate_card_id: str
+    credits_remaining: int
+
+
+@app.get(
+    "/api/subscription_state",
+    response_model=SubscriptionStateResponse,
+    dependencies=[
+        admission_controller.dependency("subscription_state", Priority.NORMAL)
+    ],
+)
+async def get_subscription_state(
+    refresh: bool = False,
+    session: AuthenticateResponse = Depends(verify_session_token),
+):
+    if refresh:
+        # Set after checkout or the customer portal, where the plan may have
+        # changed without a webhook telling us
+        subscription_state = await subscription_state_store.refresh(
+            session.user.user_id
+        )
+    else:
+        subscription_state = await subscription_state_store.get(session.user.user_id)
+    return SubscriptionStateResponse(
+        subscription_id=subscription_state.subscription_id,
+        rate_card_id=subscription_state.rate_card_id,
+        credits_remaining=subscription_state.credits_remaining,
+    )
+
+
+@app.post(
+    "/api/webhooks/lark",
+    dependencies=[admission_controller.dependency("lark_webhook", Priority.NORMAL)],
+)
+async def receive_lark_webhook(
+    request: Request,
+    x_lark_signature: Optional[str] = Header(None),
+):
+    if not LARK_WEBHOOKS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    payload = await request.body()
+    try:
+        subscription_state_store.verify_webhook_signature(payload, x_lark_signature)
+    except InvalidWebhookSignature as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+    await subscription_state_store.ingest_event(await request.json())
+    return {"received": True}
@@ -0,0 +1,90 @@
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict
+
+from asgi_correlation_id import correlation_id
+
+_trace_start: ContextVar[float | None] = ContextVar("trace_start", default=None)
+
+
+class Metrics:
+    """Small in-process metrics registry (counters, gauges and timings)."""
+
+    def __init__(self, max_timing_samples: int = 1000):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._gauges: Dict[str, float] = {}
+        self._timings: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=max_timing_samples)
+        )
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self._timings[name].append(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            timings = {}
+            for name, samples in self._timings.items():
+                ordered = sorted(samples)
+                timings[name] = {
+                    "count": len(ordered),
+                    "p50": percentile(ordered, 0.5),
+                    "p99": percentile(ordered, 0.99),
+                }
+            return {
+                # Metrics are per process, so say which worker answered
+                "pid": os.getpid(),
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "timings": timings,
+            }
+
+
+def percentile(ordered_samples: list, fraction: float) -> float | None:
+    """Nearest-rank percentile of already sorted samples, e.g. 0.99 for p99."""
+    if not ordered_samples:
+        return None
+    index = min(len(ordered_samples) - 1, int(fraction * len(ordered_samples)))
+    return ordered_samples[index]
+
+
+metrics = Metrics()
+
+
+def start_trace():
+    """Mark the start of a request so spans can report their offsets."""
+    _trace_start.set(time.monotonic())
+
+
+@contextmanager
+def trace_span(name: str):
+    """Time a pipeline stage and log its start/end relative to the request.
+
+    Overlapping stages show up as overlapping [start_ms, end_ms] ranges
+    for the same request id.
+    """
+    start = time.monotonic()
+    trace_start = _trace_start.get() or start
+    try:
+        yield
+    finally:
+        end = time.monotonic()
+        metrics.observe(f"span.{name}", end - start)
+        print(
+            f"trace request_id={correlation_id.get()} span={name} "
+            f"start_ms={(start - trace_start) * 1000:.1f} "
+            f"end_ms={(end - trace_start) * 1000:.1f}"
+        )
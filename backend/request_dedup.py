@@ -0,0 +1,136 @@
+import asyncio
+import json
+import time
+from typing import Awaitable, Callable, Dict
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from upstash_redis import Redis
+
+from admission_control import AdmissionController, Priority
+from metrics import metrics
+
+load_dotenv()
+redis = Redis.from_env()
+
+GENERATION_REQUEST_KEY_PREFIX = "generation_request:"
+
+
+class GenerationRequestDeduplicator:
+    """Makes generation requests idempotent on their X-Request-ID.
+
+    The first request for an id claims it in Redis and runs the generation.
+    Retries with the same id wait for that run and replay its response body
+    instead of generating again. Waiting retries poll Redis with a growing
+    interval, and with an admission controller they hold a LOW priority slot
+    while they wait, so they are shed before real work under overload.
+    Completed records expire after
+    `completed_ttl_seconds`. If the original run fails its claim is dropped
+    so the next retry generates from scratch.
+    """
+
+    def __init__(
+        self,
+        *,
+        in_flight_ttl_seconds: float = 120,
+        completed_ttl_seconds: float = 24 * 60 * 60,
+        poll_interval_seconds: float = 0.5,
+        max_poll_interval_seconds: float = 5,
+        admission_controller: AdmissionController | None = None,
+    ):
+        self.in_flight_ttl_seconds = in_flight_ttl_seconds
+        self.completed_ttl_seconds = completed_ttl_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.max_poll_interval_seconds = max_poll_interval_seconds
+        self.admission_controller = admission_controller
+        # Runs started by this process, so local retries don't need to poll
+        self._local_runs: Dict[str, asyncio.Future] = {}
+
+    async def run(
+        self,
+        subject_id: str,
+        request_id: str,
+        generate: Callable[[], Awaitable[str]],
+    ) -> str:
+        # Scoped per user so one user can't replay another user's generation
+        key = f"{GENERATION_REQUEST_KEY_PREFIX}{subject_id}:{request_id}"
+        while True:
+            local_run = self._local_runs.get(key)
+            if local_run is not None:
+                response_body = await asyncio.shield(local_run)
+                if response_body is not None:
+                    metrics.increment("request_dedup.replayed_in_flight")
+                    return response_body
+                continue
+
+            claimed = await asyncio.to_thread(
+                redis.set,
+                key,
+                json.dumps({"status": "in_flight"}),
+                nx=True,
+                ex=int(self.in_flight_ttl_seconds),
+            )
+            if claimed:
+                metrics.increment("request_dedup.claimed")
+                return await self._run_original(key, generate)
+
+            response_body = await self._wait_for_original(key)
+            if response_body is not None:
+                return response_body
+            # The original run failed or expired, so try to claim it ourselves
+            metrics.increment("request_dedup.reclaimed")
+
+    async def _run_original(
+        self, key: str, generate: Callable[[], Awaitable[str]]
+    ) -> str:
+        local_run = asyncio.get_running_loop().create_future()
+        self._local_runs[key] = local_run
+        try:
+            try:
+                response_body = await generate()
+            except BaseException:
+                await asyncio.to_thread(redis.delete, key)
+                raise
+
+            await asyncio.to_thread(
+                redis.set,
+                key,
+                json.dumps({"status": "completed", "response_body": response_body}),
+                ex=int(self.completed_ttl_seconds),
+            )
+            local_run.set_result(response_body)
+            return response_body
+        finally:
+            self._local_runs.pop(key, None)
+            if not local_run.done():
+                # None tells local waiters to retry on their own, including
+                # when the Redis calls above fail
+                local_run.set_result(None)
+
+    async def _wait_for_original(self, key: str) -> str | None:
+        if self.admission_controller is None:
+            return await self._poll_for_original(key)
+        async with self.admission_controller.admit(
+            "generation_request_dedup.wait", Priority.LOW
+        ):
+            return await self._poll_for_original(key)
+
+    async def _poll_for_original(self, key: str) -> str | None:
+        deadline = time.monotonic() + self.in_flight_ttl_seconds
+        poll_interval = self.poll_interval_seconds
+        while time.monotonic() < deadline:
+            raw = await asyncio.to_thread(redis.get, key)
+            if raw is None:
+                return None
+            record = json.loads(raw)
+            if record["status"] == "completed":
+                metrics.increment("request_dedup.replayed_completed")
+                return record["response_body"]
+            metrics.increment("request_dedup.polls")
+            await asyncio.sleep(min(poll_interval, deadline - time.monotonic()))
+            poll_interval = min(poll_interval * 2, self.max_poll_interval_seconds)
+
+        raise HTTPException(
+            status_code=409,
+            detail="This request is still being processed. Please try again shortly.",
+        )
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from upstash_redis import Redis
+
+from metrics import metrics
+
+
+class TwoTierCache:
+    """Worker-local TTL cache in front of a Redis tier shared by all workers.
+
+    With several gunicorn workers each one keeps its own hot entries, but a
+    miss in one worker is filled from Redis when any other worker already
+    paid for it, so hit rates don't drop as workers are added. Without a
+    Redis client the cache is local only.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        *,
+        ttl_seconds: float,
+        redis: Redis | None = None,
+        max_local_entries: int = 1024,
+    ):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.redis = redis
+        self.max_local_entries = max_local_entries
+        self._local: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+
+    async def get(self, key: str) -> str | None:
+        entry = self._local.get(key)
+        if entry and time.monotonic() < entry[0]:
+            self._local.move_to_end(key)
+            metrics.increment(f"{self.namespace}.local_hits")
+            return entry[1]
+
+        if self.redis is not None:
+            value = await asyncio.to_thread(self.redis.get, self._shared_key(key))
+            if value is not None:
+                metrics.increment(f"{self.namespace}.shared_hits")
+                self._set_local(key, value)
+                return value
+
+        metrics.increment(f"{self.namespace}.misses")
+        return None
+
+    async def set(self, key: str, value: str):
+        self._set_local(key, value)
+        if self.redis is not None:
+            await asyncio.to_thread(
+                self.redis.set,
+                self._shared_key(key),
+                value,
+                ex=int(self.ttl_seconds),
+            )
+
+    def _set_local(self, key: str, value: str):
+        self._local[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_local_entries:
+            self._local.popitem(last=False)
+
+    def _shared_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# Backend modules import each other by top-level name, as when run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules create their Redis clients at import time, tests swap in FakeRedis
+os.environ.setdefault("UPSTASH_REDIS_REST_URL", "http://redis.test")
+os.environ.setdefault("UPSTASH_REDIS_REST_TOKEN", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,126 @@
+import math
+import time
+
+
+class FakeRedis:
+    """In-memory stand-in for the parts of upstash_redis.Redis the app uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.expires_at = {}
+
+    def get(self, key):
+        self._expire(key)
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ex=None, nx=False):
+        self._expire(key)
+        if nx and key in self.data:
+            return None
+        self.data[key] = value if isinstance(value, str) else str(value)
+        self.expires_at.pop(key, None)
+        if ex is not None:
+            self.expire(key, ex)
+        return True
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+            self.expires_at.pop(key, None)
+
+    def expire(self, key, seconds):
+        if key in self.data:
+            self.expires_at[key] = time.time() + seconds
+
+    def incrby(self, key, increment):
+        value = int(self.get(key) or 0) + increment
+        self.data[key] = str(value)
+        return value
+
+    def sadd(self, key, *members):
+        self.data.setdefault(key, set()).update(members)
+
+    def smembers(self, key):
+        return set(self.data.get(key, set()))
+
+    def zadd(self, key, scores):
+        self.data.setdefault(key, {}).update(scores)
+
+    def zremrangebyscore(self, key, min_score, max_score):
+        low, high = _bound(min_score), _bound(max_score)
+        zset = self.data.get(key, {})
+        for member in [m for m, s in zset.items() if low[0] <= s <= high[0]]:
+            del zset[member]
+
+    def zrange(
+        self,
+        key,
+        start,
+        stop,
+        sortby=None,
+        rev=False,
+        offset=None,
+        count=None,
+        withscores=False,
+    ):
+        assert sortby == "BYSCORE"
+        # Like Redis, with rev the range is given as max then min
+        low, high = (
+            (_bound(stop), _bound(start)) if rev else (_bound(start), _bound(stop))
+        )
+        entries = sorted(
+            (
+                (member, score)
+                for member, score in self.data.get(key, {}).items()
+                if (score > low[0] if low[1] else score >= low[0])
+                and (score < high[0] if high[1] else score <= high[0])
+            ),
+            key=lambda entry: (entry[1], entry[0]),
+            reverse=rev,
+        )
+        if offset is not None:
+            entries = entries[offset : offset + count]
+        if withscores:
+            return [[member, score] for member, score in entries]
+        return [member for member, _ in entries]
+
+    def multi(self):
+        return _Transaction(self)
+
+    pipeline = multi
+
+    def _expire(self, key):
+        if key in self.expires_at and time.time() >= self.expires_at[key]:
+            self.delete(key)
+
+
+class _Transaction:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+
+        return queue
+
+    def exec(self):
+        return [
+            getattr(self.redis, name)(*args, **kwargs)
+            for name, args, kwargs in self.commands
+        ]
+
+
+def _bound(value):
+    """Parse a score bound into (score, exclusive)."""
+    if isinstance(value, str):
+        if value in ("-inf", "+inf"):
+            return (-math.inf if value == "-inf" else math.inf, False)
+        if value.startswith("("):
+            return (float(value[1:]), True)
+        return (float(value), False)
+    return (float(value), False)
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from admission_control import AdmissionController, Priority
+
+
+def test_freed_slots_go_to_the_highest_priority_waiting():
+    async def run():
+        controller = AdmissionController(max_concurrency=1, max_queue_depth=8)
+        admitted = []
+
+        async def request(name: str, priority: Priority):
+            async with controller.admit("test", priority):
+                admitted.append(name)
+                await asyncio.sleep(0.01)
+
+        holder = asyncio.create_task(request("holder", Priority.NORMAL))
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(request(name, priority))
+            for name, priority in [
+                ("low", Priority.LOW),
+                ("normal_1", Priority.NORMAL),
+                ("high", Priority.HIGH),
+                ("normal_2", Priority.NORMAL),
+            ]
+        ]
+        await asyncio.gather(holder, *waiting)
+        return admitted
+
+    assert asyncio.run(run()) == ["holder", "high", "normal_1", "normal_2", "low"]
+
+
+def test_timed_out_waiters_do_not_take_a_slot():
+    async def run():
+        controller = AdmissionController(
+            max_concurrency=1, max_queue_depth=8, max_queue_wait_seconds=0.01
+        )
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.admit("test", Priority.NORMAL):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as rejected:
+            async with controller.admit("test", Priority.HIGH):
+                pass
+        assert rejected.value.status_code == 503
+
+        release.set()
+        await holder
+        async with controller.admit("test", Priority.LOW):
+            pass
+
+    asyncio.run(asyncio.wait_for(run(), timeout=5))
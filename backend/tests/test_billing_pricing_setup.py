@@ -0,0 +1,201 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+from lark import AsyncLark
+
+from billing.billing_pricing_setup import (
+    DEFAULT_PLAN_SPEC_PATH,
+    LIST_PAGE_SIZE,
+    LarkPricingPlanProvisioner,
+    PricingMetricMismatch,
+)
+
+
+class FakeLarkAPI:
+    """Just enough of the Lark pricing metric and rate card endpoints."""
+
+    def __init__(self, honor_offset: bool = True):
+        self.honor_offset = honor_offset
+        self.pricing_metrics = []
+        self.rate_cards = []
+        self.created = []
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        collection = {
+            "/pricing-metrics": ("pricing_metrics", "pm"),
+            "/rate-cards": ("rate_cards", "rc"),
+        }[request.url.path]
+        resources = getattr(self, collection[0])
+
+        if request.method == "GET":
+            limit = int(request.url.params.get("limit", 10))
+            offset = (
+                int(request.url.params.get("offset", 0)) if self.honor_offset else 0
+            )
+            return httpx.Response(
+                200,
+                json={
+                    collection[0]: resources[offset : offset + limit],
+                    "has_more": offset + limit < len(resources),
+                },
+            )
+
+        resource = json.loads(request.content)
+        resource["id"] = f"{collection[1]}_{len(resources)}"
+        if collection[0] == "rate_cards":
+            resource = _rate_card_resource(resource)
+        resources.append(resource)
+        self.created.append(resource["id"])
+        return httpx.Response(200, json=resource)
+
+
+def _rate_card_resource(rate_card: dict) -> dict:
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        **rate_card,
+        "created_at": now,
+        "updated_at": now,
+        "metadata": rate_card.get("metadata") or {},
+        "fixed_rates": [
+            {"id": f"fr_{i}", **fixed_rate}
+            for i, fixed_rate in enumerate(rate_card.get("fixed_rates") or [])
+        ],
+        "usage_based_rates": [
+            {"id": f"ubr_{i}", **usage_rate}
+            for i, usage_rate in enumerate(rate_card.get("usage_based_rates") or [])
+        ],
+    }
+
+
+def _unrelated_rate_card(index: int) -> dict:
+    return _rate_card_resource(
+        {
+            "id": f"rc_other_{index}",
+            "name": f"Other plan {index}",
+            "billing_interval": "monthly",
+            "usage_based_rates": [
+                {
+                    "usage_based_rate_type": "dimensional",
+                    "code": "tokens",
+                    "name": "Tokens",
+                    "included_units": 0,
+                    "pricing_metric_id": "pm_other",
+                    "dimensions": [{"key": "model", "values": ["small"]}],
+                    "pricing_matrix": {
+                        "cells": [
+                            {
+                                "dimension_coordinates": {"model": "small"},
+                                "price": {
+                                    "price_type": "flat",
+                                    "amount": {"value": "1", "currency_code": "USD"},
+                                },
+                            }
+                        ]
+                    },
+                }
+            ],
+        }
+    )
+
+
+def _provision(fake_api: FakeLarkAPI, plan_spec: dict) -> dict:
+    async def provision():
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(fake_api.handle)
+        ) as http_client:
+            lark = AsyncLark(
+                api_key="test", base_url="http://lark.test", http_client=http_client
+            )
+            return await LarkPricingPlanProvisioner(lark, plan_spec).provision()
+
+    return asyncio.run(provision())
+
+
+def _load_plan_spec() -> dict:
+    with open(DEFAULT_PLAN_SPEC_PATH, "r") as f:
+        return json.load(f)
+
+
+def test_rerun_creates_nothing():
+    fake_api = FakeLarkAPI()
+    plan_spec = _load_plan_spec()
+
+    first_env = _provision(fake_api, plan_spec)
+    assert len(fake_api.created) == 1 + len(plan_spec["rate_cards"])
+
+    fake_api.created.clear()
+    assert _provision(fake_api, plan_spec) == first_env
+    assert fake_api.created == []
+
+
+def test_existing_plans_past_the_first_page_are_reused():
+    fake_api = FakeLarkAPI()
+    plan_spec = _load_plan_spec()
+    first_env = _provision(fake_api, plan_spec)
+
+    # Push the provisioned objects onto later pages, behind rate cards the
+    # spec can't describe
+    fake_api.pricing_metrics[:0] = [
+        {
+            "id": f"pm_other_{i}",
+            "name": f"Other metric {i}",
+            "event_name": f"other_event_{i}",
+            "unit": "events",
+            "aggregation": {"aggregation_type": "count"},
+        }
+        for i in range(LIST_PAGE_SIZE + 5)
+    ]
+    fake_api.rate_cards[:0] = [
+        _unrelated_rate_card(i) for i in range(LIST_PAGE_SIZE + 5)
+    ]
+
+    fake_api.created.clear()
+    assert _provision(fake_api, plan_spec) == first_env
+    assert fake_api.created == []
+
+
+def test_changed_plan_gets_a_new_rate_card():
+    fake_api = FakeLarkAPI()
+    plan_spec = _load_plan_spec()
+    first_env = _provision(fake_api, plan_spec)
+
+    plan_spec["rate_cards"][0]["usage_based_rates"][0]["included_units"] += 1
+    fake_api.created.clear()
+    env = _provision(fake_api, plan_spec)
+
+    changed_env_var = plan_spec["rate_cards"][0]["env_var"]
+    assert fake_api.created == [env[changed_env_var]]
+    assert env[changed_env_var] != first_env[changed_env_var]
+
+
+def test_pricing_metric_with_a_different_definition_is_refused():
+    fake_api = FakeLarkAPI()
+    plan_spec = _load_plan_spec()
+    _provision(fake_api, plan_spec)
+
+    plan_spec["pricing_metric"]["unit"] = "roasts"
+    fake_api.created.clear()
+    with pytest.raises(PricingMetricMismatch, match="unit"):
+        _provision(fake_api, plan_spec)
+    assert fake_api.created == []
+
+
+def test_listing_stops_when_offset_is_ignored():
+    fake_api = FakeLarkAPI(honor_offset=False)
+    fake_api.pricing_metrics = [
+        {
+            "id": f"pm_other_{i}",
+            "name": f"Other metric {i}",
+            "event_name": f"other_event_{i}",
+            "unit": "events",
+            "aggregation": {"aggregation_type": "count"},
+        }
+        for i in range(LIST_PAGE_SIZE + 5)
+    ]
+
+    with pytest.raises(RuntimeError, match="offset"):
+        _provision(fake_api, _load_plan_spec())
+    assert fake_api.created == []
@@ -0,0 +1,60 @@
+import asyncio
+import os
+
+import pytest
+
+from cpu_pool import configure_cpu_pool, run_on_html, run_on_text
+from generation_cache import simhash
+from website_scraper import parse_yc_company_html
+
+YC_COMPANY_PAGE = (
+    b"<html><body><h1>Lark</h1>"
+    b'<img src="https://example.com/small_logos/lark.png"></body></html>'
+)
+
+
+def crash_once(html: str, marker_path: str) -> str:
+    if not os.path.exists(marker_path):
+        open(marker_path, "w").close()
+        # Kills the pool process like a segfault or the OOM killer would
+        os._exit(1)
+    return html
+
+
+@pytest.fixture
+def cpu_pool():
+    configure_cpu_pool(1)
+    yield
+    configure_cpu_pool(0)
+
+
+def test_pool_parses_like_the_event_loop():
+    inline = asyncio.run(run_on_html(parse_yc_company_html, YC_COMPANY_PAGE, "utf-8"))
+    configure_cpu_pool(1)
+    try:
+        pooled = asyncio.run(
+            run_on_html(parse_yc_company_html, YC_COMPANY_PAGE, "utf-8")
+        )
+    finally:
+        configure_cpu_pool(0)
+    assert pooled == inline
+    assert pooled.company_name == "Lark"
+
+
+def test_broken_pool_is_replaced_and_the_task_retried(cpu_pool, tmp_path):
+    marker_path = str(tmp_path / "crashed")
+
+    result = asyncio.run(run_on_html(crash_once, b"<p>ok</p>", "utf-8", marker_path))
+
+    assert os.path.exists(marker_path)
+    assert result == "<p>ok</p>"
+    # The replacement pool keeps serving later tasks
+    assert (
+        asyncio.run(run_on_html(crash_once, b"again", "utf-8", marker_path)) == "again"
+    )
+
+
+def test_text_runs_in_the_pool_like_on_the_event_loop(cpu_pool):
+    text = "Billing for AI companies, with usage based pricing. " * 200
+
+    assert asyncio.run(run_on_text(simhash, text)) == simhash(text)
@@ -0,0 +1,210 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fetch_scheduler import DNSCache, FetchScheduler, RobotsDisallowed
+from shared_cache import TwoTierCache
+
+
+class LocalServer:
+    """HTTP server on 127.0.0.1 that records the requests it handles."""
+
+    def __init__(self, delay_seconds: float = 0, robots_txt: str | None = None):
+        self.delay_seconds = delay_seconds
+        self.robots_txt = robots_txt
+        self.paths = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+    def url(self, path: str, host: str = "127.0.0.1") -> str:
+        return f"http://{host}:{self.port}{path}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/robots.txt":
+                    if server.robots_txt is None:
+                        # Drop the connection so the fetch fails
+                        self.close_connection = True
+                        return
+                    return self._reply(server.robots_txt)
+
+                with server.lock:
+                    server.paths.append(self.path)
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                time.sleep(server.delay_seconds)
+                with server.lock:
+                    server.active -= 1
+
+                if self.path == "/set_cookie":
+                    return self._reply("ok", {"Set-Cookie": "session=abc; Path=/"})
+                self._reply(self.headers.get("Cookie") or "")
+
+            def _reply(self, body: str, headers: dict | None = None):
+                self.send_response(200)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body.encode())
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+class CountingDNSCache(DNSCache):
+    def __init__(self, addresses: list[str] | None = None, **kwargs):
+        super().__init__(**kwargs)
+        self.addresses = addresses
+        self.lookups = 0
+
+    async def _lookup(self, host: str, port: int) -> list[str]:
+        self.lookups += 1
+        return self.addresses or await super()._lookup(host, port)
+
+
+async def _fetch(scheduler: FetchScheduler, url: str) -> str:
+    async with scheduler.stream(url) as response:
+        await response.aread()
+        return response.text
+
+
+def _run(scheduler: FetchScheduler, coroutine):
+    async def run():
+        try:
+            return await coroutine
+        finally:
+            await scheduler.aclose()
+
+    return asyncio.run(run())
+
+
+def test_per_host_slots_limit_concurrent_fetches():
+    scheduler = FetchScheduler(max_concurrency=8, per_host_concurrency=2)
+    with LocalServer(delay_seconds=0.1) as server:
+
+        async def run():
+            await asyncio.gather(
+                *(_fetch(scheduler, server.url(f"/{i}")) for i in range(6))
+            )
+
+        _run(scheduler, run())
+
+    assert len(server.paths) == 6
+    assert server.max_active == 2
+
+
+def test_slots_are_shared_round_robin_across_hosts():
+    scheduler = FetchScheduler(max_concurrency=1, per_host_concurrency=1)
+    order = []
+
+    async def fetch(server: LocalServer, name: str):
+        await _fetch(scheduler, server.url("/"))
+        order.append(name)
+
+    with LocalServer(delay_seconds=0.02) as busy, LocalServer(
+        delay_seconds=0.02
+    ) as quiet:
+
+        async def run():
+            # The busy host queues all of its fetches first
+            busy_fetches = [asyncio.create_task(fetch(busy, "busy")) for _ in range(4)]
+            await asyncio.sleep(0)
+            quiet_fetches = [
+                asyncio.create_task(fetch(quiet, "quiet")) for _ in range(2)
+            ]
+            await asyncio.gather(*busy_fetches, *quiet_fetches)
+
+        _run(scheduler, run())
+
+    # The quiet host is queued behind the busy host's second fetch, from then
+    # on the hosts take turns instead of the busy host draining its queue
+    assert order == ["busy", "busy", "quiet", "busy", "quiet", "busy"]
+
+
+def test_dns_lookups_are_cached_until_the_ttl_expires():
+    dns_cache = CountingDNSCache(ttl_seconds=0.2)
+    scheduler = FetchScheduler(dns_cache=dns_cache)
+    with LocalServer() as server:
+
+        async def run():
+            await _fetch(scheduler, server.url("/a", host="localhost"))
+            await _fetch(scheduler, server.url("/b", host="localhost"))
+            assert dns_cache.lookups == 1
+            await asyncio.sleep(0.25)
+            await _fetch(scheduler, server.url("/c", host="localhost"))
+            assert dns_cache.lookups == 2
+
+        _run(scheduler, run())
+
+    assert server.paths == ["/a", "/b", "/c"]
+
+
+def test_falls_back_to_the_next_resolved_address():
+    # Nothing listens on 127.0.0.2, the server only binds 127.0.0.1
+    dns_cache = CountingDNSCache(addresses=["127.0.0.2", "127.0.0.1"])
+    scheduler = FetchScheduler(dns_cache=dns_cache)
+    with LocalServer() as server:
+        _run(scheduler, _fetch(scheduler, server.url("/", host="example.test")))
+
+    assert server.paths == ["/"]
+
+
+def test_robots_txt_disallow_is_respected():
+    scheduler = FetchScheduler(respect_robots_txt=True)
+    with LocalServer(robots_txt="User-agent: *\nDisallow: /private") as server:
+
+        async def run():
+            await _fetch(scheduler, server.url("/public"))
+            with pytest.raises(RobotsDisallowed):
+                await _fetch(scheduler, server.url("/private"))
+
+        _run(scheduler, run())
+
+    assert server.paths == ["/public"]
+
+
+def test_robots_txt_fetch_errors_are_not_shared():
+    robots_cache = TwoTierCache("robots_txt", ttl_seconds=60)
+    scheduler = FetchScheduler(respect_robots_txt=True, robots_cache=robots_cache)
+    with LocalServer(robots_txt=None) as server:
+
+        async def run():
+            await _fetch(scheduler, server.url("/"))
+            origin = server.url("")
+            assert await robots_cache.get(origin) is None
+
+        _run(scheduler, run())
+
+    assert server.paths == ["/"]
+
+
+def test_cookies_are_not_kept_between_fetches():
+    scheduler = FetchScheduler()
+    with LocalServer() as server:
+
+        async def run():
+            await _fetch(scheduler, server.url("/set_cookie"))
+            return await _fetch(scheduler, server.url("/echo_cookie"))
+
+        assert _run(scheduler, run()) == ""
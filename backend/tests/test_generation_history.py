@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import character_generator
+from character_generator import CharacterGenerator, CompanyVibesCharacterInfo
+from fake_redis import FakeRedis
+
+
+@pytest.fixture
+def generator(monkeypatch):
+    monkeypatch.setattr(character_generator, "redis", FakeRedis())
+    return CharacterGenerator()
+
+
+def _generation(index: int) -> CompanyVibesCharacterInfo:
+    return CompanyVibesCharacterInfo(
+        id=f"generation_{index}",
+        company_name=f"Company {index}",
+        character_name="Character",
+        character_image_url="https://example.com/character.png",
+        reasoning="Vibes",
+    )
+
+
+def _read_history(generator: CharacterGenerator, limit: int) -> list:
+    generation_ids = []
+    cursor = None
+    while True:
+        page = asyncio.run(generator.get_generation_history("user_1", cursor, limit))
+        generation_ids += [generation.id for generation in page.generations]
+        cursor = page.next_cursor
+        if cursor is None:
+            return generation_ids
+
+
+def test_pages_cover_generations_stored_in_the_same_instant(generator, monkeypatch):
+    # Every generation gets the same timestamp, so they all share a score
+    monkeypatch.setattr(character_generator.time, "time", lambda: 1700000000.0)
+    for index in range(7):
+        asyncio.run(
+            generator.persist_character_generation(
+                _generation(index), "https://example.com", "any_url", "user_1"
+            )
+        )
+
+    generation_ids = _read_history(generator, limit=2)
+
+    assert sorted(generation_ids) == [f"generation_{index}" for index in range(7)]
+    assert len(set(generation_ids)) == 7
+
+
+def test_pages_are_newest_first(generator, monkeypatch):
+    for index in range(5):
+        monkeypatch.setattr(
+            character_generator.time, "time", lambda: 1700000000.0 + index
+        )
+        asyncio.run(
+            generator.persist_character_generation(
+                _generation(index), "https://example.com", "any_url", "user_1"
+            )
+        )
+
+    assert _read_history(generator, limit=2) == [
+        f"generation_{index}" for index in reversed(range(5))
+    ]
+
+
+def test_invalid_cursor_is_rejected(generator):
+    with pytest.raises(character_generator.HTTPException) as invalid:
+        asyncio.run(generator.get_generation_history("user_1", "not a cursor", 2))
+    assert invalid.value.status_code == 400
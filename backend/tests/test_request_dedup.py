@@ -0,0 +1,71 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import request_dedup
+from admission_control import AdmissionController
+from fake_redis import FakeRedis
+from request_dedup import GenerationRequestDeduplicator
+
+KEY = "generation_request:user_1:req_1"
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(request_dedup, "redis", redis)
+    return redis
+
+
+def test_retry_waits_for_another_worker_with_backoff(redis):
+    # Another worker claimed the request and finishes it after a while
+    redis.set(KEY, json.dumps({"status": "in_flight"}))
+    polls = []
+    get = redis.get
+
+    def counting_get(key):
+        polls.append(time.monotonic())
+        return get(key)
+
+    redis.get = counting_get
+    admission_controller = AdmissionController(max_concurrency=4)
+    deduplicator = GenerationRequestDeduplicator(
+        in_flight_ttl_seconds=5,
+        poll_interval_seconds=0.02,
+        max_poll_interval_seconds=0.08,
+        admission_controller=admission_controller,
+    )
+
+    async def generate():
+        raise AssertionError("the retry must not generate again")
+
+    async def run():
+        async def complete():
+            await asyncio.sleep(0.3)
+            redis.set(KEY, json.dumps({"status": "completed", "response_body": "body"}))
+
+        asyncio.create_task(complete())
+        return await deduplicator.run("user_1", "req_1", generate)
+
+    assert asyncio.run(run()) == "body"
+    intervals = [later - earlier for earlier, later in zip(polls, polls[1:])]
+    assert intervals[1] > intervals[0]
+    assert max(intervals) < 0.08 + 0.05
+    # The wait held an admission slot that was given back
+    assert admission_controller._active == 0
+
+
+def test_retry_gives_up_when_the_original_outlives_its_claim(redis):
+    redis.set(KEY, json.dumps({"status": "in_flight"}))
+    deduplicator = GenerationRequestDeduplicator(
+        in_flight_ttl_seconds=0.1, poll_interval_seconds=0.02
+    )
+
+    async def generate():
+        raise AssertionError("the retry must not generate again")
+
+    with pytest.raises(request_dedup.HTTPException) as still_running:
+        asyncio.run(deduplicator.run("user_1", "req_1", generate))
+    assert still_running.value.status_code == 409
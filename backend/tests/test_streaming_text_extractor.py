@@ -0,0 +1,53 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from website_scraper import StreamingTextExtractor
+
+PAGES = [
+    "<html><head><title>Lark</title></head><body><p>Billing for AI</p></body></html>",
+    "<p>Hello <b>bold</b> and <i>italic</i> world</p>",
+    "<div>  leading and trailing  </div>\n\n<div>\tnext\t</div>",
+    "<script>var x = '<p>not text</p>';</script><p>after script</p>",
+    "<style>p { color: red; }</style><p>after style</p>",
+    "<template><p>template text</p></template><p>after template</p>",
+    "<!-- a comment --><p>after comment</p><!-- another -->",
+    "<!DOCTYPE html><p>after doctype</p>",
+    "<p>before<![CDATA[cdata text]]>after</p>",
+    "<p>before</p><?php echo 1 ?><p>after processing instruction</p>",
+    "<p>a &amp; b &lt; c &#169; &copy; &nbsp;d</p>",
+    "<p>line<br>break<br/>again<img src='x.png'>done</p>",
+    "<ruby>漢<rp>(</rp><rt>kan</rt><rp>)</rp></ruby><p>ünïcödé</p>",
+    "<ul><li>one</li><li>two</li><li> </li><li>three</li></ul>",
+    "<p>unclosed <b>tags <i>everywhere",
+    "<table><tr><td>a</td><td>b</td></tr></table>text after table",
+]
+
+
+def _bs4_text(html: str) -> str:
+    return BeautifulSoup(html, "html.parser").get_text(separator=" ", strip=True)
+
+
+def _streaming_text(chunks) -> str:
+    extractor = StreamingTextExtractor()
+    for chunk in chunks:
+        extractor.feed(chunk)
+    extractor.close()
+    return extractor.get_text()
+
+
+@pytest.mark.parametrize("html", PAGES)
+def test_matches_beautifulsoup(html):
+    assert _streaming_text([html]) == _bs4_text(html)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 16])
+def test_chunked_feeding_matches_beautifulsoup(chunk_size):
+    html = "".join(PAGES)
+    chunks = [html[i : i + chunk_size] for i in range(0, len(html), chunk_size)]
+    assert _streaming_text(chunks) == _bs4_text(html)
+
+
+def test_text_length_tracks_flushed_text():
+    extractor = StreamingTextExtractor()
+    extractor.feed("<p>one</p><p>two</p><p>")
+    assert extractor.text_length == len(extractor.get_text())
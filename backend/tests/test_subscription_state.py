@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import hmac
+
+import pytest
+
+from billing import subscription_state
+from billing.billing_manager import BillingState
+from billing.subscription_state import InvalidWebhookSignature, SubscriptionStateStore
+from fake_redis import FakeRedis
+
+
+class FakeBillingManager:
+    def __init__(self, used_units: int = 1):
+        self.used_units = used_units
+        self.retrieve_calls = 0
+
+    def retrieve_billing_state(self, subject_external_id: str) -> BillingState:
+        self.retrieve_calls += 1
+        return BillingState(
+            subscription_id="sub_1",
+            rate_card_id="rc_free",
+            included_units=5,
+            used_units=self.used_units,
+        )
+
+
+@pytest.fixture
+def store(monkeypatch):
+    monkeypatch.setattr(subscription_state, "redis", FakeRedis())
+    monkeypatch.setattr(subscription_state, "LARK_WEBHOOK_SECRET", "whsec_test")
+    return SubscriptionStateStore(FakeBillingManager())
+
+
+def _usage_event(event_id: str, idempotency_key: str, value: int = 1) -> dict:
+    return {
+        "id": event_id,
+        "type": "usage_event.created",
+        "data": {
+            "subject_id": "user_1",
+            "idempotency_key": idempotency_key,
+            "data": {"value": value},
+        },
+    }
+
+
+def _credits_remaining(store: SubscriptionStateStore) -> int:
+    return asyncio.run(store.get("user_1")).credits_remaining
+
+
+def test_redelivered_usage_event_is_applied_once(store):
+    assert _credits_remaining(store) == 4
+
+    event = _usage_event("evt_1", "req_1")
+    asyncio.run(store.ingest_event(event))
+    asyncio.run(store.ingest_event(event))
+
+    assert _credits_remaining(store) == 3
+
+
+def test_self_reported_usage_is_not_counted_again_by_its_webhook(store):
+    assert _credits_remaining(store) == 4
+
+    asyncio.run(store.record_usage("user_1", 1, idempotency_key="req_1"))
+    assert _credits_remaining(store) == 3
+
+    asyncio.run(store.ingest_event(_usage_event("evt_1", "req_1")))
+    asyncio.run(store.record_usage("user_1", 1, idempotency_key="req_1"))
+    assert _credits_remaining(store) == 3
+
+
+def test_usage_without_idempotency_key_is_deduplicated_by_event_id(store):
+    assert _credits_remaining(store) == 4
+
+    event = _usage_event("evt_1", None, value=2)
+    asyncio.run(store.ingest_event(event))
+    asyncio.run(store.ingest_event(event))
+
+    assert _credits_remaining(store) == 2
+
+
+def test_subscription_event_rereads_lark(store):
+    assert _credits_remaining(store) == 4
+
+    store.billing_manager.used_units = 0
+    asyncio.run(
+        store.ingest_event(
+            {
+                "id": "evt_1",
+                "type": "subscription.rate_card_changed",
+                "data": {"subject_id": "user_1"},
+            }
+        )
+    )
+
+    assert _credits_remaining(store) == 5
+
+
+def test_webhook_signature_is_hex_hmac_sha256_of_the_body(store):
+    payload = b'{"type": "usage_event.created"}'
+    signature = hmac.new(b"whsec_test", payload, hashlib.sha256).hexdigest()
+    store.verify_webhook_signature(payload, signature)
+
+    with pytest.raises(InvalidWebhookSignature):
+        store.verify_webhook_signature(payload, "0" * 64)
+    with pytest.raises(InvalidWebhookSignature):
+        store.verify_webhook_signature(payload, None)
+
+
+def test_webhooks_are_rejected_without_a_secret(store, monkeypatch):
+    monkeypatch.setattr(subscription_state, "LARK_WEBHOOK_SECRET", None)
+    with pytest.raises(InvalidWebhookSignature):
+        store.verify_webhook_signature(b"{}", None)
@@ -7,10 +7,26 @@ import os
 from bs4 import BeautifulSoup
 import httpx
 import html as ihtml
+from upstash_redis import Redis
+from html.parser import HTMLParser
 
+from cpu_pool import run_on_html
+from fetch_scheduler import ROBOTS_TXT_TTL_SECONDS, DNSCache, FetchScheduler
+from metrics import trace_span
+from shared_cache import TwoTierCache
 
 load_dotenv()
 
+GENERAL_URL_TEXT_LIMIT = 10000
+# Upper bound on a scrape, including waiting for a fetch slot
+SCRAPE_DEADLINE_SECONDS = float(os.getenv("SCRAPE_DEADLINE_SECONDS") or 20)
+FETCH_MAX_CONCURRENCY = int(os.getenv("FETCH_MAX_CONCURRENCY") or 32)
+FETCH_PER_HOST_CONCURRENCY = int(os.getenv("FETCH_PER_HOST_CONCURRENCY") or 2)
+FETCH_DNS_TTL_SECONDS = float(os.getenv("FETCH_DNS_TTL_SECONDS") or 300)
+FETCH_RESPECT_ROBOTS_TXT = (
+    os.getenv("FETCH_RESPECT_ROBOTS_TXT", "false").lower() == "true"
+)
+
 
 class YCCompanyInfo(BaseModel):
     company_name: str
@@ -18,68 +34,174 @@ class YCCompanyInfo(BaseModel):
     raw_text: str
 
 
+class GeneralUrlData(BaseModel):
+    # Url after following redirects
+    url: str
+    raw_text: str
+    extracted: bool
+
+
+class StreamingTextExtractor(HTMLParser):
+    """Incremental equivalent of BeautifulSoup's get_text(separator=" ", strip=True).
+
+    Text can be read while the page is still downloading, so callers can stop
+    once they have enough of it.
+    """
+
+    IGNORED_TAGS = {"script", "style", "template", "rt", "rp"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._strings: list[str] = []
+        self._pending: list[str] = []
+        self._ignored_depth = 0
+        self.text_length = 0
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in self.IGNORED_TAGS:
+            self._ignored_depth += 1
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in self.IGNORED_TAGS and self._ignored_depth > 0:
+            self._ignored_depth -= 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._flush()
+
+    def handle_comment(self, data):
+        self._flush()
+
+    def handle_data(self, data):
+        if self._ignored_depth == 0:
+            self._pending.append(data)
+
+    def unknown_decl(self, data):
+        self._flush()
+        # BeautifulSoup keeps CDATA sections as their own string
+        if data.startswith("CDATA[") and self._ignored_depth == 0:
+            self._pending.append(data[len("CDATA[") :])
+            self._flush()
+
+    def get_text(self) -> str:
+        return " ".join(self._strings)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        text = "".join(self._pending).strip()
+        self._pending = []
+        if text:
+            # +1 for the separator
+            self.text_length += len(text) + (1 if self._strings else 0)
+            self._strings.append(text)
+
+
+def parse_yc_company_html(html_content: str) -> YCCompanyInfo | None:
+    soup = BeautifulSoup(html_content, "html.parser")
+    name = None
+    small_logo_url = None
+
+    # 1) Preferred: parse the JSON in the big data-page attribute
+    host = soup.select_one('div[id^="ycdc_new/pages/Companies/ShowPage"][data-page]')
+    if host and host.has_attr("data-page"):
+        raw = host["data-page"]
+        try:
+            data = json.loads(ihtml.unescape(str(raw)))
+            company = data.get("props", {}).get("company", {})
+            name = company.get("name") or name
+            small_logo_url = company.get("small_logo_url") or small_logo_url
+        except Exception:
+            pass  # fall back if JSON is malformed
+
+    # 2) Fallbacks from visible DOM
+    if not name:
+        h1 = soup.select_one("h1")
+        if h1:
+            name = h1.get_text(strip=True)
+
+    if not small_logo_url:
+        img = soup.select_one('img[src*="small_logos"]')
+        if img and img.has_attr("src"):
+            small_logo_url = img["src"]
+
+    if not name or not small_logo_url or not isinstance(small_logo_url, str):
+        return None
+
+    return YCCompanyInfo(
+        company_name=name,
+        company_small_logo_url=small_logo_url,
+        raw_text=soup.get_text(strip=True),
+    )
+
+
 class WebsiteScraper:
     def __init__(self):
-        pass
+        # Used for arbitrary user supplied urls in the any_url mode
+        self.fetch_scheduler = FetchScheduler(
+            max_concurrency=FETCH_MAX_CONCURRENCY,
+            per_host_concurrency=FETCH_PER_HOST_CONCURRENCY,
+            dns_cache=DNSCache(ttl_seconds=FETCH_DNS_TTL_SECONDS),
+            respect_robots_txt=FETCH_RESPECT_ROBOTS_TXT,
+            # Shared so every worker doesn't fetch robots.txt for the same host
+            robots_cache=TwoTierCache(
+                "robots_txt",
+                ttl_seconds=ROBOTS_TXT_TTL_SECONDS,
+                redis=Redis.from_env(),
+            ),
+        )
 
     async def extract_yc_data_using_http(self, url: str) -> YCCompanyInfo | None:
-        async with httpx.AsyncClient() as client:
+        async with asyncio.timeout(
+            SCRAPE_DEADLINE_SECONDS
+        ), httpx.AsyncClient() as client:
             response = await client.get(url)
             response.raise_for_status()
-            html_content = response.text
 
-            soup = BeautifulSoup(html_content, "html.parser")
-            name = None
-            small_logo_url = None
-
-            # 1) Preferred: parse the JSON in the big data-page attribute
-            host = soup.select_one(
-                'div[id^="ycdc_new/pages/Companies/ShowPage"][data-page]'
-            )
-            if host and host.has_attr("data-page"):
-                raw = host["data-page"]
-                try:
-                    data = json.loads(ihtml.unescape(str(raw)))
-                    company = data.get("props", {}).get("company", {})
-                    name = company.get("name") or name
-                    small_logo_url = company.get("small_logo_url") or small_logo_url
-                except Exception:
-                    pass  # fall back if JSON is malformed
-
-            # 2) Fallbacks from visible DOM
-            if not name:
-                h1 = soup.select_one("h1")
-                if h1:
-                    name = h1.get_text(strip=True)
-
-            if not small_logo_url:
-                img = soup.select_one('img[src*="small_logos"]')
-                if img and img.has_attr("src"):
-                    small_logo_url = img["src"]
-
-            if not name or not small_logo_url or not isinstance(small_logo_url, str):
-                return None
-
-            return YCCompanyInfo(
-                company_name=name,
-                company_small_logo_url=small_logo_url,
-                raw_text=soup.get_text(strip=True),
+            # Parsing the full page is CPU bound, so it runs in the CPU pool
+            return await run_on_html(
+                parse_yc_company_html, response.content, response.encoding
             )
 
-    async def extract_general_url_data_using_http(self, url: str) -> str:
+    async def extract_general_url_data_using_http(self, url: str) -> GeneralUrlData:
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(url)
-                response.raise_for_status()
-                html_content = response.text
-
-                soup = BeautifulSoup(html_content, "html.parser")
-                text_content = soup.get_text(separator=" ", strip=True)
-
-                # Limit to 10k characters
-                return text_content[:10000]
+            with trace_span("scrape"):
+                async with asyncio.timeout(
+                    SCRAPE_DEADLINE_SECONDS
+                ), self.fetch_scheduler.stream(url, follow_redirects=True) as response:
+                    response.raise_for_status()
+                    # Parsed on the event loop even with a CPU pool: parsing
+                    # as chunks arrive stops the download at the text limit,
+                    # which usually costs less than shipping the page to a pool
+                    raw_text = await self._stream_text(response)
+
+                return GeneralUrlData(
+                    url=str(response.url),
+                    raw_text=raw_text,
+                    extracted=True,
+                )
         except (httpx.HTTPStatusError, httpx.RequestError, Exception):
-            return "Could not extract text from url"
+            return GeneralUrlData(
+                url=url,
+                raw_text="Could not extract text from url",
+                extracted=False,
+            )
+
+    async def _stream_text(self, response: httpx.Response) -> str:
+        extractor = StreamingTextExtractor()
+        async for chunk in response.aiter_text():
+            extractor.feed(chunk)
+            # Text already flushed won't change, so once we have enough of it
+            # stop downloading and hand off to the LLM
+            if extractor.text_length >= GENERAL_URL_TEXT_LIMIT:
+                break
+        extractor.close()
+        return extractor.get_text()[:GENERAL_URL_TEXT_LIMIT]
 
 
 async def run():
@@ -35,17 +35,30 @@ export const generateCompanyCharacters = async (
   companyUrl: string,
   sessionToken: string
 ): Promise<CompanyCharacterInfo> => {
-  const response = await fetch(`${API_BASE_URL}/api/company_characters`, {
-    method: "POST",
-    headers: {
-      "Content-Type": "application/json",
-      Authorization: `Bearer ${sessionToken}`,
-    },
-    body: JSON.stringify({
-      company_url: companyUrl,
-      mode: APP_MODE === "vibes" ? "any_url" : "yc_company",
-    }),
-  });
+  // Reused across retries so the backend replays the original generation
+  // instead of generating (and billing) a new one
+  const requestId = crypto.randomUUID();
+  const sendRequest = () =>
+    fetch(`${API_BASE_URL}/api/company_characters`, {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        Authorization: `Bearer ${sessionToken}`,
+        "X-Request-ID": requestId,
+      },
+      body: JSON.stringify({
+        company_url: companyUrl,
+        mode: APP_MODE === "vibes" ? "any_url" : "yc_company",
+      }),
+    });
+
+  let response: Response;
+  try {
+    response = await sendRequest();
+  } catch {
+    // Network error, e.g. a flaky mobile connection
+    response = await sendRequest();
+  }
 
   if (!response.ok) {
     const errorData = await response.json().catch(() => ({}));
@@ -192,3 +205,37 @@ export const createCustomerPortalSession = async ({
 
   return response.json();
 };
+
+
+export interface SubscriptionStateResponse {
+  subscription_id: string;
+  rate_card_id: string;
+  credits_remaining: number;
+}
+
+export const getSubscriptionState = async ({
+  sessionToken,
+  refresh = false,
+}: {
+  sessionToken: string;
+  // Re-read the plan from Lark instead of the backend's stored copy
+  refresh?: boolean;
+}): Promise<SubscriptionStateResponse> => {
+  const response = await fetch(
+    `${API_BASE_URL}/api/subscription_state${refresh ? "?refresh=true" : ""}`,
+    {
+      headers: {
+        Authorization: `Bearer ${sessionToken}`,
+      },
+    }
+  );
+
+  if (!response.ok) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(
+      errorData.detail || `Request failed with status ${response.status}`
+    );
+  }
+
+  return response.json();
+};
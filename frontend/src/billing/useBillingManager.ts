@@ -1,7 +1,18 @@
 import { useStytch, useStytchUser } from "@stytch/react";
-import { BillingState, getBillingState } from "./larkClient";
+import { BillingState, getBillingStateFromBackend } from "./larkClient";
 import { createCustomerPortalSession } from "../api/api";
 
+// Set on the urls Stripe checkout and the customer portal send users back
+// to, where the plan may have just changed
+const BILLING_CHANGED_QUERY_PARAMS = ["upgrade_success", "billing_portal_return"];
+
+function billingMayHaveChanged(): boolean {
+  const urlParams = new URLSearchParams(window.location.search);
+  return BILLING_CHANGED_QUERY_PARAMS.some(
+    (param) => urlParams.get(param) === "true"
+  );
+}
+
 export function useBillingManager(): {
   createCustomerPortalSession: ({
     returnUrl,
@@ -24,16 +35,19 @@ export function useBillingManager(): {
   }: {
     returnUrl: string;
   }): Promise<string> => {
+    const returnUrlWithFlag = new URL(returnUrl);
+    returnUrlWithFlag.searchParams.set("billing_portal_return", "true");
     const response = await createCustomerPortalSession({
-      returnUrl,
+      returnUrl: returnUrlWithFlag.toString(),
       sessionToken: sessionToken,
     });
     return response.url;
   };
 
   const getBillingStateWrapper = async (): Promise<BillingState> => {
-    return await getBillingState({
-      subjectId: stytchUserId,
+    return await getBillingStateFromBackend({
+      sessionToken: sessionToken,
+      refresh: billingMayHaveChanged(),
     });
   };
 
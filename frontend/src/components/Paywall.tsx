@@ -63,7 +63,8 @@ export function Paywall({
       setShowSuccessToast(true);
       // Redirect to home page after 2 seconds
       setTimeout(() => {
-        window.location.href = "/";
+        // Tells the dashboard to re-read the new plan from Lark
+        window.location.href = "/?upgrade_success=true";
       }, 2000);
     }
   }, []);
@@ -113,7 +114,8 @@ export function Paywall({
         // Show success toast and redirect to home page
         setShowSuccessToast(true);
         setTimeout(() => {
-          window.location.href = "/";
+          // Tells the dashboard to re-read the new plan from Lark
+        window.location.href = "/?upgrade_success=true";
         }, 2000);
       }
     } catch (err) {